@@ -12,11 +12,12 @@
 Import required libraries and specific functions.
 '''
 
-from flask import Flask, render_template, request
+from flask import Flask, Response, render_template, request, jsonify, url_for, session, stream_with_context
+from werkzeug.datastructures import MultiDict
 from wtforms import Form, TextField, validators
 from wtforms.validators import DataRequired, Optional
 from datetime import datetime
-import sys, time, requests, subprocess, os, re
+import sys, time, requests, subprocess, os, re, io, hashlib, tempfile
 import os.path
 from os import path
 import pandas as pd
@@ -29,34 +30,50 @@ Import Bokeh Functions
 from bokeh.io import show
 from bokeh.plotting import figure, output_file, show, ColumnDataSource
 from bokeh.models import LinearColorMapper, BasicTicker, PrintfTickFormatter, ColorBar, ContinuousTicker, CheckboxButtonGroup, CheckboxGroup, CustomJS
-from bokeh.models import Legend, LegendItem, Range1d, HoverTool, RedoTool, UndoTool
+from bokeh.models import Legend, LegendItem, Range1d, HoverTool, RedoTool, UndoTool, CustomJSHover
 from bokeh.models.widgets import Tabs, Panel
+from bokeh.core.properties import value
 from bokeh.embed import components
 from bokeh.layouts import layout, widgetbox, column, row, gridplot
 from bokeh.palettes import Viridis5, Magma256, PiYG
 from bokeh.models import Arrow, OpenHead, NormalHead, VeeHead
 
+import bundles, cache, config, columnar, downsample, ensembl, gene_index, genome, jobs, metrics, pahmm, profiler, scoring, streaming, symbols
+from kmers import kmer_windows
+
 
 application = Flask(__name__)
 
 
-'''
-Initialize Global Varaibles
-'''
+def load_secret_key():
+
+    '''
+    Returns the key that signs session cookies. Every worker process must use
+    the same key, so it comes from FLASK_SECRET_KEY or from a file that the
+    first process to start creates.
+    '''
+
+    if os.environ.get('FLASK_SECRET_KEY'):
+        return os.environ['FLASK_SECRET_KEY']
+
+    if not os.path.exists(config.SECRET_KEY_FILE):
+        fd, tmp_path = tempfile.mkstemp(dir = os.path.dirname(config.SECRET_KEY_FILE))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(os.urandom(32))
+        try:
+            os.link(tmp_path, config.SECRET_KEY_FILE)
+        except FileExistsError:
+            pass
+        os.remove(tmp_path)
 
-gene_from_genome = ''
-biological_identifier = ''
-upstreamBuf = ''
-downstreamBuf = ''
-user_input_seq = ''
-seq = ''
-file_name = ''
-script = ''
-div = ''
-script2 = ''
-div2 = ''
+    with open(config.SECRET_KEY_FILE, 'rb') as f:
+        return f.read()
 
 
+''' The session cookie holds the cache key of each visitor's last plots. '''
+
+application.secret_key = load_secret_key()
+
 
 class RequiredIf(DataRequired):
 
@@ -97,44 +114,62 @@ class InputForm(Form):
 
 
 
-@application.route('/', methods=['GET', 'POST'])
-def index():
-    form = InputForm(request.form)
-    if request.method == 'POST' and form.validate():
+class GeneNotFound(Exception):
+    pass
+
+
+TOOLS = "hover, save, box_zoom, pan, undo, redo, reset, wheel_zoom, tap"
 
-        global gene_from_genome
-        global biological_identifier
-        global upstreamBuf
-        global downstreamBuf
-        global user_input_seq
 
-        gene_from_genome = form.gene.data
-        upstreamBuf = form.upstream_buffer.data
-        downstreamBuf = form.downstream_buffer.data
-        user_input_seq = form.sequence.data
-        biological_identifier = form.identifier.data
+def run_query(gene_from_genome, upstreamBuf, downstreamBuf, user_input_seq, biological_identifier, resolved = None):
 
+    '''
+    Runs the full pipeline for one query: writes the FASTA file and batch
+    script for paHMM, waits for its result and builds the plots. Returns the
+    (script, div) components of the plots. Raises GeneNotFound if the gene is
+    not in the local database.
+
+    The paHMM output and the rendered components are cached per gene and
+    buffers (or per hash of a user sequence, gene and buffers), so a
+    repeated query skips Ensembl, paHMM and Bokeh. Genes pre-rendered by
+    bundles.py are served from their bundle before the cache is consulted.
+
+    `resolved` is the (gene, query) pair from resolve_query, for callers that
+    have already resolved the submission.
+    '''
+
+    if resolved is None:
+        resolved = resolve_query(gene_from_genome, upstreamBuf, downstreamBuf, user_input_seq)
+    gene_from_genome, query = resolved
+
+    plot_key, result_key = cache_keys(query)
+
+    plots = metrics.cache_lookup('bundle', bundles.load_json(plot_key))
+    if plots is not None:
+        return plots['script'], plots['div']
+
+    plots = metrics.cache_lookup('plots', result_cache.get_json(plot_key))
+    if plots is not None:
+
+        ''' The plots zoom through /plotdata, which reads the paHMM output, so keep it as fresh as the plots. '''
+
+        result_cache.touch(result_key)
+        return plots['script'], plots['div']
 
+    result = metrics.cache_lookup('result', result_cache.get(result_key))
+
+    if result is None:
         now = datetime.now()
         current_timestamp = str(datetime.timestamp(now))
-        print("timestamp =", current_timestamp)
-
-        global file_name
 
-        if (len(gene_from_genome) != 0 and len(user_input_seq) == 0):
-            gene_from_genome = convert_to_symbol(gene_from_genome)
-            print(gene_from_genome)
-            if (gene_from_genome == 'dne'):
-                print('heyo, made it here')
-                return render_template('error2.html')
-            else:
-                seq_check = False
-                file_name = gene_from_genome+'_'+upstreamBuf+'_'+downstreamBuf+'_'+current_timestamp+'.fa'
-                fasta_file = open('/var/kristoph_flask/outfiles/'+file_name, 'w')
-                fasta_file.write(get_seq(gene_from_genome, upstreamBuf, downstreamBuf))
-                fasta_file.close()
+        if (query[0] == 'gene'):
+            file_name = gene_from_genome+'_'+upstreamBuf+'_'+downstreamBuf+'_'+current_timestamp+'.fa'
+            with metrics.stage('sequence_fetch'):
+                seq = get_seq(gene_from_genome, upstreamBuf, downstreamBuf)
+            fasta_file = open('/var/kristoph_flask/outfiles/'+file_name, 'w')
+            fasta_file.write(seq)
+            fasta_file.close()
         else:
-            seq_check = True
             file_name = 'userseq'+'_'+current_timestamp+'.fa'
             fasta_file = open('/var/kristoph_flask/outfiles/'+file_name, 'w')
             fasta_file.write(biological_identifier+'\n')
@@ -142,61 +177,385 @@ def index():
             fasta_file.close()
 
         create_batchScript(file_name)
-        
-        processed_file = file_name+'.pos.txt'
 
-        print(processed_file)
-        path_to_file = '/var/www/vhosts/knaggert-vm.mdibl.net/flask_project/paHMM/testHMM/Export/'+processed_file
+        processed_file = pahmm.result_name(file_name)
+
+        ''' Lets /jobs/<id>/stream tail the output while paHMM writes it. '''
+
+        job = jobs.current()
+        if job is not None:
+            job.output = os.path.join(config.EXPORT_DIR, processed_file)
+
+        with metrics.stage('hmm_wait'):
+            path_to_file = pahmm.wait_for_result(processed_file)
 
-        while not path.exists(path_to_file):
-            time.sleep(1)
+        with open(path_to_file, 'rb') as f:
+            result = f.read()
+        result_cache.set(result_key, result)
 
-        
-        raw_data = pd.read_csv(path_to_file, sep = '\s+', skiprows = 1, header = None, names = ['Base', 'Position', 'e1', 'e2', 'e3', 'pASite', 'e4'])
+    with metrics.stage('dataset_extraction'):
+        frames = load_gene_frames(gene_from_genome)
 
-        while(raw_data.empty):
-            print(raw_data.empty)
-            time.sleep(1)
-            raw_data = pd.read_csv(path_to_file, sep = '\s+', skiprows = 1, header = None, names = ['Base', 'Position', 'e1', 'e2', 'e3', 'pASite', 'e4'])
+    with metrics.stage('figure_build'):
+        raw_data = read_result(result)
 
-        TOOLS = "hover, save, box_zoom, pan, undo, redo, reset, wheel_zoom, tap"
+        ''' 6-mer starting at each position, shared by both plots. '''
 
-        print("Check 1")
-        col1, col2, col3 = gridded_plots(raw_data, TOOLS, gene_from_genome, upstreamBuf)
-        
-        print("Check 2")
+        kmers = kmer_windows(raw_data.Base.values, 6)
+
+        col1, col2, col3 = gridded_plots(raw_data, TOOLS, frames, upstreamBuf, kmers, result_key)
         heatmap = Intensity_Plot(raw_data, TOOLS)
 
-        print("Check 3")
-        l1 = gridplot([[col3]])
-        l2 = gridplot([[heatmap]])
+        tabs = plot_tabs(col1, col2, col3, heatmap)
+
+    with metrics.stage('serialization'):
+        script, div = components(tabs)
 
-        print("Check 4")
-        tab1 = Panel(child=l1, title="Line")
-        tab2 = Panel(child=l2, title="heatmap")
-        
-        print("Check 5")
-        tab = Tabs(tabs=[ tab1, tab2 ])
+    result_cache.set_json(plot_key, {'script': script, 'div': div})
 
-        print("Check 6")
-        l3 = gridplot([[col1, tab]])
-        l4 = gridplot([[col2, tab]])
+    return script, div
 
-        print("Check 7")
-        t1 = Panel(child=l3, title="Independent")
-        t2 = Panel(child=l4, title="Staged")
 
-        print("Check 8")
-        tabs = Tabs(tabs=[ t1, t2 ])
+def plot_tabs(col1, col2, col3, heatmap):
 
-        global script
-        global div
+    ''' Lays out the plots of one query as the Independent and Staged tabs. '''
 
-        script, div = components(tabs)
-        
-        print('complete, no errors')
+    l1 = gridplot([[col3]])
+    l2 = gridplot([[heatmap]])
+
+    tab1 = Panel(child=l1, title="Line")
+    tab2 = Panel(child=l2, title="heatmap")
+
+    tab = Tabs(tabs=[ tab1, tab2 ])
+
+    l3 = gridplot([[col1, tab]])
+    l4 = gridplot([[col2, tab]])
+
+    t1 = Panel(child=l3, title="Independent")
+    t2 = Panel(child=l4, title="Staged")
 
-    return render_template('query2.html', form = form, gene_from_genome = gene_from_genome, upstreamBuf = upstreamBuf, downstreamBuf = downstreamBuf, user_input_seq = user_input_seq, seq = seq, script = script, div = div)
+    tabs = Tabs(tabs=[ t1, t2 ])
+
+    return tabs
+
+
+def resolve_query(gene_from_genome, upstreamBuf, downstreamBuf, user_input_seq):
+
+    '''
+    Returns the systematic gene name and the cache query of a submission.
+    Raises GeneNotFound if the gene is not in the local database.
+    '''
+
+    if (len(gene_from_genome) != 0 and len(user_input_seq) == 0):
+        with metrics.stage('symbol_lookup'):
+            symbol = convert_to_symbol(gene_from_genome)
+        if (symbol == 'dne'):
+            raise GeneNotFound('The gene '+gene_from_genome+' is not in our database.')
+        gene_from_genome = symbol
+        query = ['gene', gene_from_genome, upstreamBuf, downstreamBuf]
+    else:
+
+        ''' The overlays still come from the gene's datasets and buffers, so they are part of the key. '''
+
+        query = ['seq', hashlib.sha256(user_input_seq.encode()).hexdigest(), gene_from_genome, upstreamBuf, downstreamBuf]
+
+    return gene_from_genome, query
+
+
+def cache_keys(query):
+
+    ''' Returns the (plots, paHMM output) keys of a query in the result cache and bundles. '''
+
+    return cache.make_key('plots', *query), cache.make_key('pos', *query)
+
+
+def read_result(result):
+
+    ''' Parses the bytes of a paHMM .pos.txt file. '''
+
+    return pd.read_csv(io.BytesIO(result), sep = '\s+', skiprows = 1, header = None, names = pahmm.RESULT_COLUMNS)
+
+
+result_cache = cache.DiskCache(config.RESULT_CACHE_DIR, config.RESULT_CACHE_BYTES, config.RESULT_CACHE_ENTRIES)
+
+job_queue = jobs.JobQueue(run_query, workers = config.JOB_WORKERS)
+
+
+@application.route('/', methods=['GET', 'POST'])
+def index():
+
+    '''
+    Runs a submitted query, or shows the visitor's last plots. Query state is
+    local to the request and the last plots are found through the session,
+    so concurrent requests never see each other's results.
+
+    With config.STREAM_RESULTS, a query that is not cached is queued as a
+    job and the page shows a preview that fills in while paHMM runs.
+
+    With ?profile=<config.PROFILE_TOKEN>, the query runs in this request
+    under the sampling profiler instead, and the page links the profile.
+    '''
+
+    form = InputForm(request.form)
+
+    gene_from_genome = form.gene.data
+    upstreamBuf = form.upstream_buffer.data
+    downstreamBuf = form.downstream_buffer.data
+    user_input_seq = form.sequence.data
+    biological_identifier = form.identifier.data
+
+    script = ''
+    div = ''
+    profile_url = None
+    profile = profiler.allowed(request.args.get('profile'))
+
+    if request.method == 'POST' and form.validate():
+
+        try:
+            if profile:
+                with profiler.Sampler() as sampler:
+                    resolved = resolve_query(gene_from_genome, upstreamBuf, downstreamBuf, user_input_seq)
+                    query = resolved[1]
+                    plot_key = cache_keys(query)[0]
+                    script, div = run_query(gene_from_genome, upstreamBuf, downstreamBuf, user_input_seq, biological_identifier, resolved)
+                profile_id = profiler.save(sampler.speedscope(' '.join(query)))
+                profile_url = url_for('debug_profile', profile_id = profile_id, profile = request.args.get('profile'))
+            else:
+                resolved = resolve_query(gene_from_genome, upstreamBuf, downstreamBuf, user_input_seq)
+                plot_key = cache_keys(resolved[1])[0]
+                if config.STREAM_RESULTS and not os.path.exists(bundles.path(plot_key)) and not os.path.exists(result_cache.path(plot_key)):
+                    job = job_queue.submit(gene_from_genome, upstreamBuf, downstreamBuf, user_input_seq, biological_identifier, resolved)
+                    script, div = stream_preview(job)
+                else:
+                    script, div = run_query(gene_from_genome, upstreamBuf, downstreamBuf, user_input_seq, biological_identifier, resolved)
+        except GeneNotFound:
+            return render_template('error2.html')
+        except ensembl.EnsemblError as e:
+            return str(e)+'; please try again later.', 503
+        except TimeoutError as e:
+            return str(e)+'; paHMM may be overloaded, please try again later.', 504
+
+        session['plots'] = plot_key
+
+    elif 'plots' in session:
+        plots = bundles.load_json(session['plots']) or result_cache.get_json(session['plots'])
+        if plots is not None:
+            script, div = plots['script'], plots['div']
+
+    return render_template('query2.html', form = form, gene_from_genome = gene_from_genome, upstreamBuf = upstreamBuf, downstreamBuf = downstreamBuf, user_input_seq = user_input_seq, script = script, div = div, profile_url = profile_url)
+
+
+@application.route('/debug/profile/<profile_id>')
+def debug_profile(profile_id):
+
+    '''
+    Returns a profile saved by index() as speedscope JSON; open it in
+    speedscope.app for a flamegraph. Needs the same ?profile= token.
+    '''
+
+    if not profiler.allowed(request.args.get('profile')):
+        return jsonify(error = 'not found'), 404
+
+    profile = profiler.load(profile_id)
+    if profile is None:
+        return jsonify(error = 'not found'), 404
+
+    response = Response(profile, mimetype = 'application/json')
+    response.headers['Content-Disposition'] = 'attachment; filename='+profile_id+'.speedscope.json'
+
+    return response
+
+
+@application.route('/jobs', methods=['POST'])
+def submit_job():
+
+    '''
+    Queues a query and returns its job id immediately. Accepts the same fields
+    as the input form, either form-encoded or as a JSON object. Job ids are
+    only known to the process that queued them (see jobs.py).
+    '''
+
+    if request.is_json:
+        body = request.get_json(silent = True)
+        if not isinstance(body, dict):
+            return jsonify(errors = 'the request body must be a JSON object'), 400
+
+        ''' Values are read as form strings, so 100 and "100" are the same query. '''
+
+        form = InputForm(MultiDict({name: '' if value is None else str(value) for name, value in body.items()}))
+    else:
+        form = InputForm(request.form)
+
+    if not form.validate():
+        return jsonify(errors = form.errors), 400
+
+    job = job_queue.submit(form.gene.data, form.upstream_buffer.data, form.downstream_buffer.data, form.sequence.data, form.identifier.data)
+
+    response = jsonify(job_id = job.id, status = job.status, status_url = url_for('job_status', job_id = job.id))
+    response.status_code = 202
+    response.headers['Location'] = url_for('job_status', job_id = job.id)
+
+    return response
+
+
+@application.route('/jobs/<job_id>')
+def job_status(job_id):
+
+    '''
+    Returns the status of a job, plus the plot script/div once it is done.
+    '''
+
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify(error = 'unknown job'), 404
+
+    return jsonify(job.as_dict())
+
+
+@application.route('/jobs/<job_id>/stream')
+def job_stream(job_id):
+
+    '''
+    Server-Sent Events for a job: the paHMM rows as they are written, then
+    the job's final status (see streaming.py).
+    '''
+
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify(error = 'unknown job'), 404
+
+    response = Response(stream_with_context(streaming.job_events(job)), mimetype = 'text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+
+    return response
+
+
+def stream_preview(job):
+
+    '''
+    Returns (script, div) for a plot of a running job's paHMM scores that is
+    extended by the job's event stream, and replaced by the full plots once
+    the job is done.
+    '''
+
+    source = ColumnDataSource(data = {column: [] for column in streaming.STREAM_COLUMNS})
+
+    p = figure(title = 'paHMM scores (running)', sizing_mode = 'stretch_both', tools = "save, box_zoom, pan, reset, wheel_zoom",
+               tooltips = [('Position', '@Position')])
+    for i, column in enumerate(STACKED_COLUMNS):
+        p.line('Position', column, line_width = 2, color = Viridis5[i], legend = value(column), source = source)
+    p.legend.location = "top_left"
+    p.xaxis.axis_label = "Position"
+    p.yaxis.axis_label = "Score"
+
+    script, div = components(p)
+
+    ''' Rows that arrive before Bokeh has embedded the preview wait in `pending`. '''
+
+    script = script + '''
+<script type="text/javascript">
+(function() {
+    var pending = [];
+    var events = new EventSource('%s');
+    function flush() {
+        var source = null;
+        for (var i = 0; i < Bokeh.documents.length && source === null; i++) {
+            source = Bokeh.documents[i].get_model_by_id('%s');
+        }
+        if (source === null) {
+            return;
+        }
+        while (pending.length) {
+            source.stream(pending.shift());
+        }
+    }
+    events.addEventListener('rows', function(e) {
+        pending.push(JSON.parse(e.data));
+        flush();
+    });
+    events.addEventListener('done', function(e) {
+        events.close();
+        var job = JSON.parse(e.data);
+        if (job.status == 'done') {
+            $('#stream-%s').html(job.div + job.script);
+        } else {
+            $('#stream-%s').html('<p>paHMM failed: ' + $('<span>').text(job.error).html() + '</p>');
+        }
+    });
+})();
+</script>''' % (url_for('job_stream', job_id = job.id), source.id, job.id, job.id)
+
+    return script, '<div id="stream-'+job.id+'">'+div+'</div>'
+
+
+@application.route('/metrics')
+def metrics_endpoint():
+
+    ''' Stage latencies, cache hits and queue depth in the Prometheus text format (see metrics.py). '''
+
+    metrics.QUEUE_DEPTH.set(job_queue.depth())
+
+    return Response(metrics.render(), mimetype = 'text/plain; version=0.0.4')
+
+
+@application.route('/symbols', methods=['POST'])
+def resolve_symbols():
+
+    '''
+    Resolves a list of gene names in one call. Expects {"names": [...]} and
+    returns {"symbols": {name: systematic name or "dne"}}.
+    '''
+
+    names = (request.get_json(silent = True) or {}).get('names')
+    if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+        return jsonify(error = 'expected {"names": [...]}'), 400
+
+    return jsonify(symbols = convert_to_symbols(names))
+
+
+@application.route('/plotdata/<result_id>')
+def plot_data(result_id):
+
+    '''
+    Returns one window of a result's per-position columns for the zoom
+    callbacks (see downsample.py), decimated to at most `points` per series.
+    axis=Position serves the stacked plots; axis=aligned_pos serves the
+    overlays, aligned as origin + sign*Position.
+    '''
+
+    result = None
+    if re.match('^[0-9a-f]{64}$', result_id):
+        result = result_cache.get(result_id) or bundles.load(result_id)
+    if result is None:
+        return jsonify(error = 'unknown result'), 404
+
+    try:
+        start = float(request.args['start'])
+        end = float(request.args['end'])
+        points = min(int(request.args.get('points', config.PLOT_POINTS)), config.PLOT_POINTS)
+        origin = float(request.args.get('origin', 0))
+        sign = float(request.args.get('sign', 1))
+    except (KeyError, ValueError):
+        return jsonify(error = 'bad window'), 400
+
+    raw_data = read_result(result)
+    df_comp = score_frame(raw_data, kmer_windows(raw_data.Base.values, 6))
+
+    if request.args.get('axis') == 'aligned_pos':
+        axis = 'aligned_pos'
+        df_comp['aligned_pos'] = origin + sign * df_comp.Position
+        columns = OVERLAY_COLUMNS
+        extra = []
+    else:
+        axis = 'Position'
+        columns = STACKED_COLUMNS
+        extra = ['Seq']
+
+    window = df_comp[(df_comp[axis] >= start) & (df_comp[axis] <= end)]
+    window = downsample.decimate(window, axis, columns, points)
+
+    return jsonify({c: window[c].tolist() for c in [axis] + columns + extra})
 
 
 application.route('/about')
@@ -219,18 +578,9 @@ def lit():
 def create_batchScript(file_name):
 
     trunc_file = file_name[0:-3]
-    print(trunc_file)
     test_file_name = 'testScript_'+trunc_file+'.txt'
-    print(test_file_name)
     batchScript = open('/var/kristoph_flask/outfiles/testScripts/'+test_file_name, 'w')
-    batchScript.write('/var/www/vhosts/knaggert-vm.mdibl.net/flask_project/paHMM/testHMM\n')
-    batchScript.write('load\n')
-    batchScript.write('yeastHMM\n')
-    batchScript.write('apply\n')
-    batchScript.write('yeastP\n')
-    batchScript.write('3 22 41 55 64 -1\n')
-    batchScript.write('/var/kristoph_flask/outfiles/fa_files/'+file_name+'\n')
-    batchScript.write('exit')
+    batchScript.write(pahmm.batch_script('/var/kristoph_flask/outfiles/fa_files/'+file_name))
     batchScript.close()
 
     return
@@ -239,110 +589,117 @@ def get_seq(gene_from_genome, upstreamBuf, downstreamBuf):
 
     '''
     Sourced from: https://rest.ensembl.org/documentation/info/sequence_id
+
+    Uses the local genome (see genome.py) when it is installed and has the
+    gene, and calls the Ensembl REST API otherwise (see ensembl.py), which
+    raises ensembl.EnsemblError if the sequence cannot be fetched.
     '''
 
-    server = "https://rest.ensembl.org"
+    if genome.available():
+        try:
+            return genome.get_seq(gene_from_genome, upstreamBuf, downstreamBuf)
+        except genome.GenomeError:
+            pass
 
-    ext = '/sequence/id/'+gene_from_genome+'?expand_5prime='+upstreamBuf+';expand_3prime='+downstreamBuf
+    return ensembl.get_seq(gene_from_genome, upstreamBuf, downstreamBuf)
 
-    r = requests.get(server+ext, headers={ "Content-Type" : "text/x-fasta"})
 
-    if not r.ok:
-        r.raise_for_status()
-        sys.exit()
 
-    seq = r.text
+def convert_to_symbol(gene_from_genome):
 
-    return seq
+    '''
+    Returns the systematic name for a systematic or standard gene name, or
+    'dne' if results.tsv has neither. The table is held in memory (see
+    symbols.py) and reloaded when the file changes.
+    '''
 
+    return symbols.table.resolve(gene_from_genome)
 
+def convert_to_symbols(names):
 
-def convert_to_symbol(gene_from_genome):
+    ''' Batch version of convert_to_symbol; returns {name: systematic name or 'dne'}. '''
 
-    ''' Read in the data '''
+    return symbols.table.resolve_many(names)
 
-    df = pd.read_csv('/var/kristoph_flask/data/results.tsv', delimiter= '\s+', header = None, names = ['Sys_Name','Std_Name'])
+def extract_gene_rows(dataset_file, gene_from_genome):
 
-    gene_from_genome = gene_from_genome.upper()
+    '''
+    Returns the rows of one dataset file whose '#gene' column is exactly
+    gene_from_genome, as bytes. Uses the per-gene byte-offset index (see
+    gene_index.py) to seek straight to the gene's rows, and only scans the
+    whole file if the dataset has not been indexed. Nothing is written to
+    disk, so concurrent queries for the same gene cannot interfere.
+    '''
 
-    if (any(df['Sys_Name'] == gene_from_genome)):
-        gene_from_genome = gene_from_genome
-        return gene_from_genome
-    elif ((all(df['Sys_Name'] != gene_from_genome) and (all(df['Std_Name'] != gene_from_genome)))):
-        gene_from_genome = 'dne'
-        return gene_from_genome
-    else:
-        index = next(iter(df[df.Std_Name==gene_from_genome].index), 'No match.')
-        gene_from_genome = df.Sys_Name[index]
-        return gene_from_genome
+    rows = gene_index.read_gene_rows(dataset_file, gene_from_genome)
 
-    '''
-    Currently has no way to catch and inform the user of the application
-    if the standard gene name or systematic gene name do not exist in the
-    local database.
+    if rows is None:
 
-    Also need to create a catch if there is no input, becuase there are certain
-    entries in the gene list (results.tsv) whose Std_Name entry is ""and the
-    application might break if the program tries to find the gene name "" when a
-    user sequence is input.
-    '''
+        ''' Compare the first column only, so YAL001C does not match YAL001C-A or a number. '''
 
-def Intensity_Plot(data, TOOLS):
+        gene = gene_from_genome.encode()
+        n = len(gene)
+        with open(os.path.join(config.DATA_DIR, dataset_file), 'rb') as f:
+            rows = b''.join(line for line in f if line.startswith(gene) and line[n:n+1].isspace())
 
-    dataI = data
-    
-    columns = ['e1', 'e2', 'e3', 'pASite', 'e4']
+    return rows
 
-    array_1 = []
+def load_gene_dataset(dataset, kind, gene_from_genome):
 
-    for k in range(len(dataI)):
-        if (k+6 >= len(dataI)):
-            array_1.append("N/A")
-        else:
-            s = ""
-            list1 = []
-            for l in range(k, k+6):
-                list1.append(dataI.Base[l])
-            s = s.join(list1)
-            array_1.append(s)
+    '''
+    Returns the rows of one dataset file for gene_from_genome, keeping only
+    config.KEEP_COLUMNS. Reads the columnar store when the dataset has been
+    ingested (see columnar.py), otherwise extracts and parses the text rows
+    in memory.
+    '''
+
+    if columnar.has_store(dataset, kind):
+        return columnar.load_gene(dataset, kind, gene_from_genome)
 
-    sequences = []
-    for n in range(len(dataI)*len(columns)):
-        sequences.append(n)
+    rows = extract_gene_rows(config.dataset_file(dataset, kind), gene_from_genome)
+    if not rows:
+        return pd.DataFrame(columns = config.KEEP_COLUMNS)
 
-    temporary = 0
-    for q in range(len(array_1)):
-        for d in range(len(columns)):
-            sequences[temporary] = array_1[q]
-            temporary = temporary+1
+    return pd.read_csv(io.BytesIO(rows), sep = '\s+', header = None, names = config.DATASET_COLUMNS[dataset], usecols = config.KEEP_COLUMNS)
 
-    Sequences = pd.DataFrame(sequences, columns = ['Sequence'])
+def Intensity_Plot(data, TOOLS):
+
+    '''
+    Draws the state scores as one image glyph: a 5 x N array with a row per
+    state. The hover looks the 6-mer up in the sequence string rather than
+    carrying a Sequence column for every cell.
+    '''
 
-    dataI['Position'] = dataI['Position'].astype(str)
-    dataI = dataI.set_index('Position')
+    columns = ['e1', 'e2', 'e3', 'pASite', 'e4']
 
-    dataI = dataI.drop(columns = ['Base'])
+    scores = data[columns].values.T.astype(np.float32)
+    first = int(data['Position'].iloc[0])
+    n = scores.shape[1]
 
-    dataI.columns.name = 'Values'
-    Position = list(dataI.index)
-    Position = list(map(int, Position))
-    Values = list(dataI.columns)
+    mapper = LinearColorMapper(palette = Magma256[::-1], high = float(scores.max()), low = float(scores.min()))
 
-    df_I = pd.DataFrame(dataI.stack(), columns = ['score']).reset_index()
+    source = ColumnDataSource(data = dict(image = [scores], bases = [''.join(data['Base'])]))
 
-    df_complete = pd.concat([df_I, Sequences], axis = 1)
+    ''' Both tooltips read $x, so the formatter gives the position itself unless asked for {custom}. '''
 
-    print(df_complete.head(20))
-    
-    Magma256.reverse()
-    mapper = LinearColorMapper(palette = Magma256, high = df_complete.score.max(), low = df_complete.score.min())
+    sequence = CustomJSHover(args = dict(source = source), code = '''
+        if (format != 'custom') {
+            return String(Math.round(value));
+        }
+        var bases = source.data.bases[0];
+        var i = Math.round(value) - %d;
+        if (i < 0 || i > bases.length - 6) {
+            return 'N/A';
+        }
+        return bases.substr(i, 6);
+    ''' % first)
 
-    p = figure(title = "Heatmap of Sites", x_range = (0,len(Position)), y_range = Values, 
+    p = figure(title = "Heatmap of Sites", x_range = (0,n), y_range = columns, 
                x_axis_location = "above", sizing_mode = 'stretch_both',
                tools = TOOLS, toolbar_location = 'below',
-               tooltips = [('Position','@Position'), ('Score', '@score'), ('Sequence', '@Sequence')])
-
+               tooltips = [('Position', '$x{0}'), ('Score', '@image'), ('Sequence', '$x{custom}')])
 
+    p.select_one(HoverTool).formatters = {'$x': sequence}
 
     p.grid.grid_line_color = None
     p.axis.axis_line_color = None
@@ -351,10 +708,9 @@ def Intensity_Plot(data, TOOLS):
     p.axis.major_label_standoff = 0
     p.xaxis.major_label_orientation = pi / 3
 
-    p.rect(x = 'Position', y = 'Values', width = 1, height = 1,
-           source = df_complete,
-           fill_color = {'field':'score', 'transform' : mapper},
-           line_color = None)
+    ''' The factor axis puts state r between r and r + 1, so image row r lines up with its label. '''
+
+    p.image(image = 'image', source = source, x = first - 0.5, y = 0, dw = n, dh = len(columns), color_mapper = mapper)
 
     color_bar = ColorBar(color_mapper = mapper, major_label_text_font_size = "10pt",
                          ticker = BasicTicker(),
@@ -365,56 +721,80 @@ def Intensity_Plot(data, TOOLS):
     return(p)
 
 
-def gridded_plots(raw_data, TOOLS, gene_from_genome, upstreamBuf):
+STACKED_COLUMNS = ['e1', 'e2', 'e3', 'pASite', 'e4']
+OVERLAY_COLUMNS = ['cumulative', 'pASiteT', 'cumul2']
 
-    dataS = raw_data
+''' Dataset, legend label and colour of each dataset's line on the overlay plots. '''
+
+DATASET_LINES = [('pcf11', 'pcf11_DRS', '#4dac26'), ('decay', 'Decay1', '#b8e186'),
+                 ('decay2', 'Decay2', '#f1b6da'), ('steinmetz', 'Steinmetz', '#d01c8b')]
+
+
+def binary_source(frame, columns):
 
     '''
-    Stacked Plots (Left-Hand Side)
+    A ColumnDataSource of frame[columns] with float columns as float32 and
+    integer columns as int32, which Bokeh embeds base64-encoded instead of
+    as JSON lists. Other columns (the 6-mers) are passed through.
     '''
 
-    array = []
+    data = {}
+    for c in columns:
+        values = frame[c].values
+        if values.dtype.kind == 'f':
+            values = values.astype(np.float32)
+        elif values.dtype.kind in 'iu':
+            values = values.astype(np.int32)
+        data[c] = values
 
-    for k in range(len(dataS)):
-        if (k+6 >= len(dataS)):
-            array.append("N/A")
-        else:
-            s = ""
-            list_1 = []
-            for l in range(k, k+6):
-                list_1.append(dataS.Base[l])
-            s = s.join(list_1)
-            array.append(s)
+    return ColumnDataSource(data = data)
 
-    Seq = pd.DataFrame(array, columns = ['Seq'])
-    df_comp = pd.concat([dataS, Seq], axis = 1)
 
-    a = 1.5
-    b = 18.5
+def score_frame(raw_data, kmers):
 
-    temp = []
-    for q in range(len(df_comp)):
-        temp.append(1 - 1/(1 + 2**(a*(df_comp.pASite[q] - b))))
+    ''' The paHMM result plus its 6-mers and pA-site probabilities. '''
 
-    df_comp['pASiteT'] = temp
+    df_comp = raw_data.copy()
+    df_comp['Seq'] = kmers
 
-    temp2 = []
+    cumulative, pASiteT = scoring.independent_cumulative(scoring.site_probability(df_comp.pASite.values))
+
+    df_comp['pASiteT'] = pASiteT
+    df_comp['cumulative'] = cumulative
+    df_comp['cumul2'] = scoring.staged_cumulative(df_comp.pASiteT.values)
+
+    return df_comp
 
-    for s in range(len(df_comp)):
-        if (s == 0):
-            temp2.append(df_comp['pASiteT'][0])
-        else:
-            temp2.append(df_comp['pASiteT'][s]+temp2[s-1])
 
-    df_comp['cumulative'] = temp2
+def load_gene_frames(gene_from_genome):
 
-    last = len(df_comp)
-    L_entry = df_comp.cumulative[last-1]
+    ''' Returns {dataset: (cumPa rows, paProb rows)} for a gene, with the per-site increments of cumPa. '''
 
-    df_comp['cumulative'] = df_comp['cumulative']/L_entry
-    df_comp['pASiteT'] = df_comp['pASiteT']/L_entry
+    frames = {}
+    for dataset in config.DATASETS:
+        cumPa = load_gene_dataset(dataset, 'cumPa', gene_from_genome)
+        cumPa['p_indep'] = scoring.site_increments(cumPa['all'].values)
+        frames[dataset] = (cumPa, load_gene_dataset(dataset, 'paProb', gene_from_genome))
 
-    source = ColumnDataSource(df_comp)
+    return frames
+
+
+def gridded_plots(raw_data, TOOLS, frames, upstreamBuf, kmers, result_id = None):
+
+    '''
+    Stacked Plots (Left-Hand Side)
+
+    `frames` holds each dataset's rows for the gene (see load_gene_frames).
+
+    Long sequences are decimated to config.PLOT_POINTS points per series at
+    first render. With a result_id, zooming fetches the visible window again
+    from /plotdata.
+    '''
+
+    df_comp = score_frame(raw_data, kmers)
+
+    stacked = downsample.decimate(df_comp, 'Position', STACKED_COLUMNS, config.PLOT_POINTS)
+    source = binary_source(stacked, ['Position'] + STACKED_COLUMNS + ['Seq'])
 
     ''' Individual Line Graph for  e1 '''
 
@@ -458,301 +838,93 @@ def gridded_plots(raw_data, TOOLS, gene_from_genome, upstreamBuf):
     s5.yaxis.axis_label = "Score"
     s5.xaxis.axis_label = "Position"
 
-    ''' PCF11 '''
-
-    file = open('/var/kristoph_flask/data/pcf11_cumPa.txt', 'r')
-
-    for line in file:
-        if re.search(gene_from_genome, line):
-            with open('/var/kristoph_flask/data/'+gene_from_genome+'_pcf11_specGeneData.txt', 'a+') as f:
-                f.write(line)
-
-    file2 = open('/var/kristoph_flask/data/pcf11_paProb.txt', 'r')
-
-    for line2 in file2:
-        if re.search(gene_from_genome, line2):
-            with open('/var/kristoph_flask/data/'+gene_from_genome+'_pcf11_specGeneProb.txt', 'a+') as fa:
-                fa.write(line2)
-
+    if result_id is not None:
+        loader = downsample.window_loader(source, '/plotdata/'+result_id+'?axis=Position')
+        s1.x_range.js_on_change('start', loader)
+        s1.x_range.js_on_change('end', loader)
 
-    data = pd.read_csv('/var/kristoph_flask/data/'+gene_from_genome+'_pcf11_specGeneData.txt', sep = '\s+', header = None, names = ['#gene', 'chromo', 'position', 'strand', 'distToCDSstop', 'distToCDSstart', 'avgGcount','AGcount',
-                                                                                                                                    'Acount', 'Gcount', 'DHch01_20nt_Ttrim', 'DHch02_20nt_Ttrim', 'DHch03_20nt_Ttrim', 'DHch04_20nt_Ttrim', 'DHch05_20nt_Ttrim', 'DHch06_20nt_Ttrim', 'DHch07_20nt_Ttrim', 'DHch08_20nt_Ttrim', 'all'])
+    ''' pcf11 sets the strand and CDS. '''
 
-    df = pd.read_csv('/var/kristoph_flask/data/'+gene_from_genome+'_pcf11_specGeneProb.txt', sep = '\s+', header = None, names = ['#gene', 'chromo', 'position', 'strand', 'distToCDSstop', 'distToCDSstart', 'avgGcount','AGcount',
-                                                                                                                                  'Acount', 'Gcount', 'DHch01_20nt_Ttrim', 'DHch02_20nt_Ttrim', 'DHch03_20nt_Ttrim', 'DHch04_20nt_Ttrim', 'DHch05_20nt_Ttrim', 'DHch06_20nt_Ttrim', 'DHch07_20nt_Ttrim', 'DHch08_20nt_Ttrim', 'all'])
-
-
-    data = data.drop(['strand', 'avgGcount','AGcount', 'Acount', 'Gcount', 'DHch01_20nt_Ttrim', 'DHch02_20nt_Ttrim', 'DHch03_20nt_Ttrim', 'DHch04_20nt_Ttrim', 'DHch05_20nt_Ttrim', 'DHch06_20nt_Ttrim', 'DHch07_20nt_Ttrim', 'DHch08_20nt_Ttrim'], axis = 1)
-    df = df.drop(['strand', 'avgGcount','AGcount', 'Acount', 'Gcount', 'DHch01_20nt_Ttrim', 'DHch02_20nt_Ttrim', 'DHch03_20nt_Ttrim', 'DHch04_20nt_Ttrim', 'DHch05_20nt_Ttrim', 'DHch06_20nt_Ttrim', 'DHch07_20nt_Ttrim', 'DHch08_20nt_Ttrim'], axis = 1)
-
-
-    ''' decay1 '''
-
-
-    file3 = open('/var/kristoph_flask/data/decay_cumPa.txt', 'r')
-
-    for line3 in file3:
-        if re.search(gene_from_genome, line3):
-            with open('/var/kristoph_flask/data/'+gene_from_genome+'_decay_specGeneData.txt', 'a+') as f:
-                f.write(line3)
-
-    file4 = open('/var/kristoph_flask/data/decay_paProb.txt', 'r')
-
-    for line4 in file4:
-        if re.search(gene_from_genome, line4):
-            with open('/var/kristoph_flask/data/'+gene_from_genome+'_decay_specGeneProb.txt', 'a+') as fa:
-                fa.write(line4)
-
-    data2 = pd.read_csv('/var/kristoph_flask/data/'+gene_from_genome+'_decay_specGeneData.txt', sep = '\s+', header = None, names = ['#gene', 'chromo', 'position', 'strand', 'distToCDSstop', 'distToCDSstart', 'avgGcount', 'AGcount', 'Acount', 'Gcount', 'UA00e1_filtered_uniq30nt', 'UA05e1_filtered_uniq30nt', 'UA10e1_filtered_uniq30nt', 'UA20e1_filtered_uniq30nt', 'UA40e1_filtered_uniq30nt', 'UB00e1_filtered_uniq30nt', 'UB05e1_filtered_uniq30nt', 'UB10e1_filtered_uniq30nt', 'UB20e1_filtered_uniq30nt','UB40e1_filtered_uniq30nt','YA00e1_filtered_uniq30nt','YA05e1_filtered_uniq30nt','YA10e1_filtered_uniq30nt','YA20e1_filtered_uniq30nt','YA40e1_filtered_uniq30nt','YB00e1_filtered_uniq30nt','YB05e1_filtered_uniq30nt','YB10e1_filtered_uniq30nt','YB20e1_filtered_uniq30nt','YB40e1_filtered_uniq30nt','all'])
-
-    df2 = pd.read_csv('/var/kristoph_flask/data/'+gene_from_genome+'_decay_specGeneProb.txt', sep = '\s+', header = None, names = ['#gene', 'chromo', 'position', 'strand', 'distToCDSstop', 'distToCDSstart', 'avgGcount', 'AGcount', 'Acount', 'Gcount', 'UA00e1_filtered_uniq30nt', 'UA05e1_filtered_uniq30nt', 'UA10e1_filtered_uniq30nt', 'UA20e1_filtered_uniq30nt', 'UA40e1_filtered_uniq30nt', 'UB00e1_filtered_uniq30nt', 'UB05e1_filtered_uniq30nt', 'UB10e1_filtered_uniq30nt', 'UB20e1_filtered_uniq30nt','UB40e1_filtered_uniq30nt','YA00e1_filtered_uniq30nt','YA05e1_filtered_uniq30nt','YA10e1_filtered_uniq30nt','YA20e1_filtered_uniq30nt','YA40e1_filtered_uniq30nt','YB00e1_filtered_uniq30nt','YB05e1_filtered_uniq30nt','YB10e1_filtered_uniq30nt','YB20e1_filtered_uniq30nt','YB40e1_filtered_uniq30nt','all'])
-
-    data2 = data2.drop(['strand', 'avgGcount', 'AGcount', 'Acount', 'Gcount', 'UA00e1_filtered_uniq30nt', 'UA05e1_filtered_uniq30nt', 'UA10e1_filtered_uniq30nt', 'UA20e1_filtered_uniq30nt', 'UA40e1_filtered_uniq30nt', 'UB00e1_filtered_uniq30nt', 'UB05e1_filtered_uniq30nt', 'UB10e1_filtered_uniq30nt', 'UB20e1_filtered_uniq30nt','UB40e1_filtered_uniq30nt','YA00e1_filtered_uniq30nt','YA05e1_filtered_uniq30nt','YA10e1_filtered_uniq30nt','YA20e1_filtered_uniq30nt','YA40e1_filtered_uniq30nt','YB00e1_filtered_uniq30nt','YB05e1_filtered_uniq30nt','YB10e1_filtered_uniq30nt','YB20e1_filtered_uniq30nt','YB40e1_filtered_uniq30nt'], axis=1)
-
-    df2 =  df2.drop(['strand', 'avgGcount', 'AGcount', 'Acount', 'Gcount', 'UA00e1_filtered_uniq30nt', 'UA05e1_filtered_uniq30nt', 'UA10e1_filtered_uniq30nt', 'UA20e1_filtered_uniq30nt', 'UA40e1_filtered_uniq30nt', 'UB00e1_filtered_uniq30nt', 'UB05e1_filtered_uniq30nt', 'UB10e1_filtered_uniq30nt', 'UB20e1_filtered_uniq30nt','UB40e1_filtered_uniq30nt','YA00e1_filtered_uniq30nt','YA05e1_filtered_uniq30nt','YA10e1_filtered_uniq30nt','YA20e1_filtered_uniq30nt','YA40e1_filtered_uniq30nt','YB00e1_filtered_uniq30nt','YB05e1_filtered_uniq30nt','YB10e1_filtered_uniq30nt','YB20e1_filtered_uniq30nt','YB40e1_filtered_uniq30nt'], axis=1)
-
-    ''' decay2 '''
-
-    file5 = open('/var/kristoph_flask/data/decay2_cumPa.txt', 'r')
-
-    for line5 in file5:
-        if re.search(gene_from_genome, line5):
-            with open('/var/kristoph_flask/data/'+gene_from_genome+'_decay2_specGeneData.txt', 'a+') as f:
-                f.write(line5)
-
-    file6 = open('/var/kristoph_flask/data/decay2_paProb.txt', 'r')
-
-    for line6 in file6:
-        if re.search(gene_from_genome, line6):
-            with open('/var/kristoph_flask/data/'+gene_from_genome+'_decay2_specGeneProb.txt', 'a+') as fa:
-                fa.write(line6)
-
-    data3 = pd.read_csv('/var/kristoph_flask/data/'+gene_from_genome+'_decay2_specGeneData.txt', sep = '\s+', header = None, names = ['#gene', 'chromo','position','strand', 'distToCDSstop', 'distToCDSstart', 'avgGcount', 'AGcount', 'Acount', 'Gcount', 'UA00e2_filtered_uniq30nt', 'UA05e2_filtered_uniq30nt', 'UA10e2_filtered_uniq30nt', 'UA20e2_filtered_uniq30nt', 'UA40e2_filtered_uniq30nt', 'UB00e2_filtered_uniq30nt', 'UB05e2_filtered_uniq30nt', 'UB10e2_filtered_uniq30nt', 'UB20e2_filtered_uniq30nt', 'UB40e2_filtered_uniq30nt', 'YA00e2_filtered_uniq30nt', 'YA05e2_filtered_uniq30nt','YA10e2_filtered_uniq30nt','YA20e2_filtered_uniq30nt','YA40e2_filtered_uniq30nt','YB00e2_filtered_uniq30nt','YB05e2_filtered_uniq30nt','YB10e2_filtered_uniq30nt','YB20e2_filtered_uniq30nt','YB40e2_filtered_uniq30nt','all'])
-
-    df3 = pd.read_csv('/var/kristoph_flask/data/'+gene_from_genome+'_decay2_specGeneProb.txt', sep = '\s+', header = None, names = ['#gene', 'chromo','position','strand', 'distToCDSstop', 'distToCDSstart', 'avgGcount', 'AGcount', 'Acount', 'Gcount', 'UA00e2_filtered_uniq30nt', 'UA05e2_filtered_uniq30nt', 'UA10e2_filtered_uniq30nt', 'UA20e2_filtered_uniq30nt', 'UA40e2_filtered_uniq30nt', 'UB00e2_filtered_uniq30nt', 'UB05e2_filtered_uniq30nt', 'UB10e2_filtered_uniq30nt', 'UB20e2_filtered_uniq30nt', 'UB40e2_filtered_uniq30nt', 'YA00e2_filtered_uniq30nt', 'YA05e2_filtered_uniq30nt','YA10e2_filtered_uniq30nt','YA20e2_filtered_uniq30nt','YA40e2_filtered_uniq30nt','YB00e2_filtered_uniq30nt','YB05e2_filtered_uniq30nt','YB10e2_filtered_uniq30nt','YB20e2_filtered_uniq30nt','YB40e2_filtered_uniq30nt','all'])
-
-    data3 = data3.drop(['strand','avgGcount', 'AGcount', 'Acount', 'Gcount', 'UA00e2_filtered_uniq30nt', 'UA05e2_filtered_uniq30nt', 'UA10e2_filtered_uniq30nt', 'UA20e2_filtered_uniq30nt', 'UA40e2_filtered_uniq30nt', 'UB00e2_filtered_uniq30nt', 'UB05e2_filtered_uniq30nt', 'UB10e2_filtered_uniq30nt', 'UB20e2_filtered_uniq30nt', 'UB40e2_filtered_uniq30nt', 'YA00e2_filtered_uniq30nt', 'YA05e2_filtered_uniq30nt','YA10e2_filtered_uniq30nt','YA20e2_filtered_uniq30nt','YA40e2_filtered_uniq30nt','YB00e2_filtered_uniq30nt','YB05e2_filtered_uniq30nt','YB10e2_filtered_uniq30nt','YB20e2_filtered_uniq30nt','YB40e2_filtered_uniq30nt'], axis = 1)
-
-    df3 = df3.drop(['strand', 'avgGcount', 'AGcount', 'Acount', 'Gcount', 'UA00e2_filtered_uniq30nt', 'UA05e2_filtered_uniq30nt', 'UA10e2_filtered_uniq30nt', 'UA20e2_filtered_uniq30nt', 'UA40e2_filtered_uniq30nt', 'UB00e2_filtered_uniq30nt', 'UB05e2_filtered_uniq30nt', 'UB10e2_filtered_uniq30nt', 'UB20e2_filtered_uniq30nt', 'UB40e2_filtered_uniq30nt', 'YA00e2_filtered_uniq30nt', 'YA05e2_filtered_uniq30nt','YA10e2_filtered_uniq30nt','YA20e2_filtered_uniq30nt','YA40e2_filtered_uniq30nt','YB00e2_filtered_uniq30nt','YB05e2_filtered_uniq30nt','YB10e2_filtered_uniq30nt','YB20e2_filtered_uniq30nt','YB40e2_filtered_uniq30nt'], axis = 1)
-
-    ''' Steinmetz '''
-
-    file7 = open('/var/kristoph_flask/data/steinmetz_cumPa.txt', 'r')
-
-    for line7 in file7:
-        if re.search(gene_from_genome, line7):
-            with open('/var/kristoph_flask/data/'+gene_from_genome+'_steinmetz_specGeneData.txt', 'a+') as f:
-                f.write(line7)
-
-    file8 = open('/var/kristoph_flask/data/steinmetz_paProb.txt', 'r')
-
-    for line8 in file8:
-        if re.search(gene_from_genome, line8):
-            with open('/var/kristoph_flask/data/'+gene_from_genome+'_steinmetz_specGeneProb.txt', 'a+') as fa:
-                fa.write(line8)
-
-    data4 = pd.read_csv('/var/kristoph_flask/data/'+gene_from_genome+'_steinmetz_specGeneData.txt', sep = '\s+', header = None, names = ['#gene', 'chromo','position', 'strand', 'distToCDSstop','distToCDSstart', 'avgGcount', 'AGcount', 'Acount','Gcount', 'Lane8ByIB_30nt_Ttrim', 'Lane8ByIIB_30nt_Ttrim', 'Lane8ByIIIB_30nt_Ttrim', 'Lane8TS1248IB_30nt_Ttrim', 'Lane8TS1248IIIB_30nt_Ttrim', 'Lane8TS685IB_30nt_Ttrim', 'Lane8TS685IIB_30nt_Ttrim', 'Lane8TS801IB_30nt_Ttrim', 'Lane8TS801IIB_30nt_Ttrim', 'Lane8TS801IIIB_30nt_Ttrim', 'lane3BY4741III_30nt_Ttrim', 'lane3TS1248II_30nt_Ttrim', 'lane3TS685III_30nt_Ttrim', 'lane3TS685II_30nt_Ttrim', 'lane3TS801III_30nt_Ttrim', 'lane3TS801I_30nt_Ttrim', 'all'])
-
-    df4 = pd.read_csv('/var/kristoph_flask/data/'+gene_from_genome+'_steinmetz_specGeneProb.txt', sep = '\s+', header = None, names = ['#gene', 'chromo','position','strand', 'distToCDSstop', 'distToCDSstart', 'avgGcount', 'AGcount', 'Acount','Gcount', 'Lane8ByIB_30nt_Ttrim', 'Lane8ByIIB_30nt_Ttrim', 'Lane8ByIIIB_30nt_Ttrim', 'Lane8TS1248IB_30nt_Ttrim', 'Lane8TS1248IIIB_30nt_Ttrim', 'Lane8TS685IB_30nt_Ttrim', 'Lane8TS685IIB_30nt_Ttrim', 'Lane8TS801IB_30nt_Ttrim', 'Lane8TS801IIB_30nt_Ttrim', 'Lane8TS801IIIB_30nt_Ttrim', 'lane3BY4741III_30nt_Ttrim', 'lane3TS1248II_30nt_Ttrim', 'lane3TS685III_30nt_Ttrim', 'lane3TS685II_30nt_Ttrim', 'lane3TS801III_30nt_Ttrim', 'lane3TS801I_30nt_Ttrim', 'all'])
-
-    data4  = data4.drop(['strand', 'avgGcount', 'AGcount', 'Acount', 'Gcount', 'Lane8ByIB_30nt_Ttrim', 'Lane8ByIIB_30nt_Ttrim', 'Lane8ByIIIB_30nt_Ttrim', 'Lane8TS1248IB_30nt_Ttrim', 'Lane8TS1248IIIB_30nt_Ttrim', 'Lane8TS685IB_30nt_Ttrim', 'Lane8TS685IIB_30nt_Ttrim', 'Lane8TS801IB_30nt_Ttrim', 'Lane8TS801IIB_30nt_Ttrim', 'Lane8TS801IIIB_30nt_Ttrim', 'lane3BY4741III_30nt_Ttrim', 'lane3TS1248II_30nt_Ttrim', 'lane3TS685III_30nt_Ttrim', 'lane3TS685II_30nt_Ttrim', 'lane3TS801III_30nt_Ttrim', 'lane3TS801I_30nt_Ttrim'], axis = 1)
-
-    df4 = df4.drop(['strand', 'avgGcount', 'AGcount', 'Acount','Gcount', 'Lane8ByIB_30nt_Ttrim', 'Lane8ByIIB_30nt_Ttrim', 'Lane8ByIIIB_30nt_Ttrim', 'Lane8TS1248IB_30nt_Ttrim', 'Lane8TS1248IIIB_30nt_Ttrim', 'Lane8TS685IB_30nt_Ttrim', 'Lane8TS685IIB_30nt_Ttrim', 'Lane8TS801IB_30nt_Ttrim', 'Lane8TS801IIB_30nt_Ttrim', 'Lane8TS801IIIB_30nt_Ttrim', 'lane3BY4741III_30nt_Ttrim', 'lane3TS1248II_30nt_Ttrim', 'lane3TS685III_30nt_Ttrim', 'lane3TS685II_30nt_Ttrim', 'lane3TS801III_30nt_Ttrim', 'lane3TS801I_30nt_Ttrim'], axis = 1)
-
-
-    d1 = []
-    for m in range(len(data)):
-        if (m == 0):
-            d1.append((data['all'][m]))
-        else:
-            d1.append((data['all'][m]-data['all'][m-1]))
-
-    data['p_indep'] = d1
-
-    d2 = []
-    for h in range(len(data2)):
-        if (h == 0):
-            d2.append((data2['all'][h]))
-        else:
-            d2.append((data2['all'][h]-data2['all'][h-1]))
-
-    data2['p_indep'] = d2
-
-    d3 = []
-    for r in range(len(data3)):
-        if (r == 0):
-            d3.append((data3['all'][r]))
-        else:
-            d3.append((data3['all'][r]-data3['all'][r-1]))
-
-    data3['p_indep'] = d3
-
-    d4 = []
-    for w in range(len(data4)):
-        if (w == 0):
-            d4.append((data4['all'][w]))
-        else:
-            d4.append((data4['all'][w]-data4['all'][w-1]))
-
-    data4['p_indep'] = d4
+    data = frames['pcf11'][0]
 
     if (data.position[0] > data.position[1]):
         antisense = True
     else:
         antisense = False
 
-    print(type(upstreamBuf))
     upstreamBuf = int(upstreamBuf)
-    print(type(upstreamBuf))
-
-    print(df_comp)
 
     if (antisense==True):
-        print("yoyoyo")
         CDS1 = data['position'][0] + data['distToCDSstart'][0]
-        print("nsync")
         gen_pos = CDS1 + upstreamBuf
-        print("yost")
-        print(type(df_comp.Position))
         df_comp['aligned_pos'] = gen_pos - df_comp.Position
-        print("fak")
     elif (antisense==False):
-        print("hihihi")
         CDS1 = data['position'][0] - data['distToCDSstart'][0]
         gen_pos = CDS1 - upstreamBuf
         df_comp['aligned_pos'] = df_comp.Position + gen_pos
 
-    print(antisense)
-
-    cumul2 = []
-
-    for y in range(len(df_comp)):
-        if (y == 0):
-            print("quo")
-            cumul2.append(df_comp.pASiteT[0])
-        else:
-            cumul2.append(cumul2[y-1]+(1 - cumul2[y-1])*df_comp.pASiteT[y])
-
-    print("yeet")
-    df_comp['cumul2'] = cumul2
-    df_comp['cumul2'] = df_comp['cumul2']/df_comp.cumul2[len(df_comp)-1]
+    overlay = downsample.decimate(df_comp, 'aligned_pos', OVERLAY_COLUMNS, config.PLOT_POINTS)
+    indep_source = binary_source(overlay, ['aligned_pos', 'cumulative', 'pASiteT'])
+    staged_source = binary_source(overlay, ['aligned_pos', 'cumul2', 'pASiteT'])
 
     if (antisense == True):
-        print("bye")
         cds1 = data.position[0]+data.distToCDSstart[0]
         cds2 = data.position[0]+data.distToCDSstop[0]
     elif (antisense == False):
-        print("poop")
         cds1 = data.position[0]-data.distToCDSstart[0]
         cds2 = data.position[0]-data.distToCDSstop[0]
     
+    ''' Each dataset file becomes one source, shared by every figure that plots it. '''
+
+    cum_sources = {}
+    prob_sources = {}
+    for dataset, (cumPa, paProb) in frames.items():
+        cum_sources[dataset] = binary_source(cumPa, ['position', 'all', 'p_indep'])
+        prob_sources[dataset] = binary_source(paProb, ['position', 'all'])
+
     if (antisense == True):
         indep_c = figure(x_range = (df_comp['aligned_pos'][0], df_comp['aligned_pos'][len(df_comp)-1]))
-        c0 = indep_c.line(data['position'], data['all'], color = '#4dac26', legend = 'pcf11_DRS', alpha = 1)
-        c1 = indep_c.line(data2['position'], data2['all'], color = '#b8e186', legend = 'Decay1', alpha = 1)
-        c2 = indep_c.line(data3['position'], data3['all'], color = '#f1b6da', legend = 'Decay2', alpha = 1)
-        c3 = indep_c.line(data4['position'], data4['all'], color = '#d01c8b', legend = 'Steinmetz', alpha = 1)
-        c4 = indep_c.line(df_comp['aligned_pos'], df_comp['cumulative'], color = '#000000', legend = '?', alpha = 1)
-        indep_c.add_layout(Arrow(end=VeeHead(size=25, fill_alpha=0.4, line_alpha=0), line_color="black", x_start=cds1, y_start=-0.05, x_end=cds2, y_end=-0.05, line_alpha = 0.4, line_width = 20))
-        indep_c.below[0].formatter.use_scientific = False
-        indep_c.legend.location = "top_left"
-        indep_c.legend.click_policy="hide"
-
-        indep_p = figure(x_range = indep_c.x_range)
-        p0 = indep_p.line(data['position'], data['p_indep'], color = '#4dac26', legend = 'pcf11_DRS', alpha = 1)
-        p1 = indep_p.line(data2['position'], data2['p_indep'], color = '#b8e186', legend = 'Decay1', alpha = 1)
-        p2 = indep_p.line(data3['position'], data3['p_indep'], color = '#f1b6da', legend = 'Decay2', alpha = 1)
-        p3 = indep_p.line(data4['position'], data4['p_indep'], color = '#d01c8b', legend = 'Steinmetz', alpha = 1)
-        p4 = indep_p.line(df_comp['aligned_pos'], df_comp['pASiteT'], color = '#000000', legend = '?', alpha = 1)
-        indep_p.below[0].formatter.use_scientific = False
-        indep_p.legend.location = "top_left"
-        indep_p.legend.click_policy="hide"
-
         staged_c = figure(x_range = (df_comp['aligned_pos'][0], df_comp['aligned_pos'][len(df_comp)-1]))
-        sc0 = staged_c.line(data['position'], data['all'], color = '#4dac26', legend = 'pcf11_DRS', alpha = 1)
-        sc1 = staged_c.line(data2['position'], data2['all'], color = '#b8e186', legend = 'Decay1', alpha = 1)
-        sc2 = staged_c.line(data3['position'], data3['all'], color = '#f1b6da', legend = 'Decay2', alpha = 1)
-        sc3 = staged_c.line(data4['position'], data4['all'], color = '#d01c8b', legend = 'Steinmetz', alpha = 1)
-        sc4 = staged_c.line(df_comp['aligned_pos'], df_comp['cumul2'], color = '#000000', legend = '?', alpha = 1)
-        staged_c.add_layout(Arrow(end=VeeHead(size=25, fill_alpha=0.4, line_alpha=0), line_color="black", x_start=cds1, y_start=-0.05, x_end=cds2, y_end=-0.05, line_alpha = 0.4, line_width = 20))
-        staged_c.below[0].formatter.use_scientific = False
-        staged_c.legend.location = "top_left"
-        staged_c.legend.click_policy="hide"
-
-        staged_p = figure(x_range = staged_c.x_range)
-        sp0 = staged_p.line(df['position'], df['all'], color = '#4dac26', legend = 'pcf11_DRS', alpha = 1)
-        sp1 = staged_p.line(df2['position'], df2['all'], color = '#b8e186', legend = 'Decay1', alpha = 1)
-        sp2 = staged_p.line(df3['position'], df3['all'], color = '#f1b6da', legend = 'Decay2', alpha = 1)
-        sp3 = staged_p.line(df4['position'], df4['all'], color = '#d01c8b', legend = 'Steinmetz', alpha = 1)
-        sp4 = staged_p.line(df_comp['aligned_pos'], df_comp['pASiteT'], color = '#000000', legend = '?', alpha = 1)
-        staged_p.below[0].formatter.use_scientific = False
-        staged_p.legend.location = "top_left"
-        staged_p.legend.click_policy="hide"
-
     elif (antisense == False):
         indep_c = figure()
-        c0 = indep_c.line(data['position'], data['all'], color = '#4dac26', legend = 'pcf11_DRS', alpha = 1)
-        c1 = indep_c.line(data2['position'], data2['all'], color = '#b8e186', legend = 'Decay1', alpha = 1)
-        c2 = indep_c.line(data3['position'], data3['all'], color = '#f1b6da', legend = 'Decay2', alpha = 1)
-        c3 = indep_c.line(data4['position'], data4['all'], color = '#d01c8b', legend = 'Steinmetz', alpha = 1)
-        c4 = indep_c.line(df_comp['aligned_pos'], df_comp['cumulative'], color = '#000000', legend = '?', alpha = 1)
-        indep_c.add_layout(Arrow(end=VeeHead(size=25, fill_alpha=0.4, line_alpha = 0), line_color="black", x_start=cds1, y_start=-0.05, x_end=cds2, y_end=-0.05, line_alpha = 0.4, line_width = 20))
-        indep_c.below[0].formatter.use_scientific = False
-        indep_c.legend.location = "top_left"
-        indep_c.legend.click_policy="hide"
-
-        indep_p = figure(x_range = indep_c.x_range)
-        p0 = indep_p.line(data['position'], data['p_indep'], color = '#4dac26', legend = 'pcf11_DRS', alpha = 1)
-        p1 = indep_p.line(data2['position'], data2['p_indep'], color = '#b8e186', legend = 'Decay1', alpha = 1)
-        p2 = indep_p.line(data3['position'], data3['p_indep'], color = '#f1b6da', legend = 'Decay2', alpha = 1)
-        p3 = indep_p.line(data4['position'], data4['p_indep'], color = '#d01c8b', legend = 'Steinmetz', alpha = 1)
-        p4 = indep_p.line(df_comp['aligned_pos'], df_comp['pASiteT'], color = '#000000', legend = '?', alpha = 1)
-        indep_p.below[0].formatter.use_scientific = False
-        indep_p.legend.location = "top_left"
-        indep_p.legend.click_policy="hide"
-
         staged_c = figure()
-        sc0 = staged_c.line(data['position'], data['all'], color = '#4dac26', legend = 'pcf11_DRS', alpha = 1)
-        sc1 = staged_c.line(data2['position'], data2['all'], color = '#b8e186', legend = 'Decay1', alpha = 1)
-        sc2 = staged_c.line(data3['position'], data3['all'], color = '#f1b6da', legend = 'Decay2', alpha = 1)
-        sc3 = staged_c.line(data4['position'], data4['all'], color = '#d01c8b', legend = 'Steinmetz', alpha = 1)
-        sc4 = staged_c.line(df_comp['aligned_pos'], df_comp['cumul2'], color = '#000000', legend = '?', alpha = 1)
-        staged_c.add_layout(Arrow(end=VeeHead(size=25, fill_alpha=0.4, line_alpha=0), line_color="black", x_start=cds1, y_start=-0.05, x_end=cds2, y_end=-0.05, line_alpha = 0.4, line_width = 20))
-        staged_c.below[0].formatter.use_scientific = False
-        staged_c.legend.location = "top_left"
-        staged_c.legend.click_policy="hide"
-
-        staged_p = figure()
-        sp0 = staged_p.line(df['position'], df['all'], color = '#4dac26', legend = 'pcf11_DRS', alpha = 1)
-        sp1 = staged_p.line(df2['position'], df2['all'], color = '#b8e186', legend = 'Decay1', alpha = 1)
-        sp2 = staged_p.line(df3['position'], df3['all'], color = '#f1b6da', legend = 'Decay2', alpha = 1)
-        sp3 = staged_p.line(df4['position'], df4['all'], color = '#d01c8b', legend = 'Steinmetz', alpha = 1)
-        sp4 = staged_p.line(df_comp['aligned_pos'], df_comp['pASiteT'], color = '#000000', legend = '?', alpha = 1)
-        staged_p.below[0].formatter.use_scientific = False
-        staged_p.legend.location = "top_left"
-        staged_p.legend.click_policy="hide"
-
-    print("shoop")
-    col1 = column(children=[indep_c, indep_p], sizing_mode='stretch_both')
-    col2 = column(children=[staged_c, staged_p], sizing_mode='stretch_both')
-    col3 = column(children=[s1, s2, s3, s4, s5], sizing_mode='stretch_both')
 
-    print(os.listdir('/var/kristoph_flask/data/'))
+    indep_p = figure(x_range = indep_c.x_range)
+    staged_p = figure(x_range = staged_c.x_range)
+
+    for dataset, legend, color in DATASET_LINES:
+        indep_c.line('position', 'all', source = cum_sources[dataset], color = color, legend = legend, alpha = 1)
+        indep_p.line('position', 'p_indep', source = cum_sources[dataset], color = color, legend = legend, alpha = 1)
+        staged_c.line('position', 'all', source = cum_sources[dataset], color = color, legend = legend, alpha = 1)
+        staged_p.line('position', 'all', source = prob_sources[dataset], color = color, legend = legend, alpha = 1)
+
+    indep_c.line('aligned_pos', 'cumulative', source = indep_source, color = '#000000', legend = '?', alpha = 1)
+    indep_p.line('aligned_pos', 'pASiteT', source = indep_source, color = '#000000', legend = '?', alpha = 1)
+    staged_c.line('aligned_pos', 'cumul2', source = staged_source, color = '#000000', legend = '?', alpha = 1)
+    staged_p.line('aligned_pos', 'pASiteT', source = staged_source, color = '#000000', legend = '?', alpha = 1)
 
-    os.remove('/var/kristoph_flask/data/'+gene_from_genome+'_pcf11_specGeneData.txt')
-    os.remove('/var/kristoph_flask/data/'+gene_from_genome+'_pcf11_specGeneProb.txt')
+    for cumulative_plot in [indep_c, staged_c]:
+        cumulative_plot.add_layout(Arrow(end=VeeHead(size=25, fill_alpha=0.4, line_alpha=0), line_color="black", x_start=cds1, y_start=-0.05, x_end=cds2, y_end=-0.05, line_alpha = 0.4, line_width = 20))
 
-    os.remove('/var/kristoph_flask/data/'+gene_from_genome+'_decay_specGeneData.txt')
-    os.remove('/var/kristoph_flask/data/'+gene_from_genome+'_decay_specGeneProb.txt')
+    for overlay_plot in [indep_c, indep_p, staged_c, staged_p]:
+        overlay_plot.below[0].formatter.use_scientific = False
+        overlay_plot.legend.location = "top_left"
+        overlay_plot.legend.click_policy="hide"
 
-    os.remove('/var/kristoph_flask/data/'+gene_from_genome+'_decay2_specGeneData.txt')
-    os.remove('/var/kristoph_flask/data/'+gene_from_genome+'_decay2_specGeneProb.txt')
+    if result_id is not None:
+        sign = -1 if antisense else 1
+        url = '/plotdata/'+result_id+'?axis=aligned_pos&origin='+str(gen_pos)+'&sign='+str(sign)
+        for overlay_range, overlay_source in [(indep_c.x_range, indep_source), (staged_c.x_range, staged_source)]:
+            loader = downsample.window_loader(overlay_source, url)
+            overlay_range.js_on_change('start', loader)
+            overlay_range.js_on_change('end', loader)
 
-    os.remove('/var/kristoph_flask/data/'+gene_from_genome+'_steinmetz_specGeneData.txt')
-    os.remove('/var/kristoph_flask/data/'+gene_from_genome+'_steinmetz_specGeneProb.txt')
+    col1 = column(children=[indep_c, indep_p], sizing_mode='stretch_both')
+    col2 = column(children=[staged_c, staged_p], sizing_mode='stretch_both')
+    col3 = column(children=[s1, s2, s3, s4, s5], sizing_mode='stretch_both')
 
     return(col1, col2, col3)
 
 
 if __name__ == '__main__':
-    application.run(debug=True)
+    application.run(debug=True, threaded=True)
@@ -0,0 +1,154 @@
+'''
+Genome-wide paHMM scoring without the web form.
+
+    python batch.py [genes.txt] [upstream downstream]
+
+scores every gene named in genes.txt (one systematic or standard name per
+line), or every systematic name in results.tsv if no list is given, with
+5' and 3' buffers of 100 and 500 unless others are given. Each gene's FASTA
+file and batch script (the create_batchScript format) go to BATCH_DIR/fasta
+and BATCH_DIR/scripts, and HMM_WORKERS hmm processes score them in parallel.
+Without a local genome, the sequences are fetched from Ensembl in batches
+(see ensembl.fetch_many), and each gene is queued for hmm as soon as its
+FASTA file is written.
+Genes whose output is already in BATCH_DIR/results are not scored again, so
+an interrupted run can be restarted.
+
+All outputs are then collected into one columnar store (see columnar.py) in
+BATCH_DIR/store: the paHMM columns plus the pA-site probability and the
+independent and staged cumulative curves the plots show, sorted by gene.
+'''
+
+import os, sys, tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import columnar, config, ensembl, genome, pahmm, scoring, symbols
+
+
+STORE_COLUMNS = ['#gene'] + pahmm.RESULT_COLUMNS + ['pASiteT', 'cumulative', 'cumul2']
+
+
+def batch_path(*parts):
+    return os.path.join(config.BATCH_DIR, *parts)
+
+
+def fetch_sequence(gene, upstreamBuf, downstreamBuf):
+
+    ''' The local genome if it has the gene, else Ensembl, like application.get_seq. '''
+
+    if genome.available():
+        try:
+            return genome.get_seq(gene, upstreamBuf, downstreamBuf)
+        except genome.GenomeError:
+            pass
+    return ensembl.get_seq(gene, upstreamBuf, downstreamBuf)
+
+
+def score_gene(gene, upstreamBuf, downstreamBuf):
+
+    '''
+    Writes the FASTA file (unless it is already there) and batch script for
+    one gene, runs hmm on it and moves the output to BATCH_DIR/results.
+    Returns the output path, or None if the gene failed.
+    '''
+
+    file_name = gene+'_'+upstreamBuf+'_'+downstreamBuf+'.fa'
+    result_path = batch_path('results', pahmm.result_name(file_name))
+    if os.path.exists(result_path):
+        return result_path
+
+    try:
+        fasta_path = batch_path('fasta', file_name)
+        if not os.path.exists(fasta_path):
+            seq = fetch_sequence(gene, upstreamBuf, downstreamBuf)
+            fd, tmp_path = tempfile.mkstemp(dir = batch_path('fasta'), prefix = '.tmp')
+            with os.fdopen(fd, 'w') as f:
+                f.write(seq)
+            os.replace(tmp_path, fasta_path)
+
+        script_path = batch_path('scripts', 'testScript_'+file_name[0:-3]+'.txt')
+        with open(script_path, 'w') as f:
+            f.write(pahmm.batch_script(fasta_path))
+
+        pahmm.run(script_path)
+        os.replace(os.path.join(config.EXPORT_DIR, pahmm.result_name(file_name)), result_path)
+    except Exception as e:
+        print(gene, 'failed:', e, file = sys.stderr)
+        return None
+
+    return result_path
+
+
+def read_output(gene, result_path):
+
+    frame = pd.read_csv(result_path, sep = '\s+', skiprows = 1, header = None, names = pahmm.RESULT_COLUMNS)
+    frame.insert(0, '#gene', gene)
+
+    cumulative, pASiteT = scoring.independent_cumulative(scoring.site_probability(frame.pASite.values))
+    frame['pASiteT'] = pASiteT.astype(np.float32)
+    frame['cumulative'] = cumulative.astype(np.float32)
+    frame['cumul2'] = scoring.staged_cumulative(pASiteT).astype(np.float32)
+
+    for column in ['e1', 'e2', 'e3', 'pASite', 'e4']:
+        frame[column] = frame[column].astype(np.float32)
+
+    return frame
+
+
+def run_batch(genes, upstreamBuf = '100', downstreamBuf = '500'):
+
+    '''
+    Scores `genes` (systematic names) and writes the columnar store. Returns
+    the genes that failed.
+    '''
+
+    for directory in ['fasta', 'scripts', 'results']:
+        os.makedirs(batch_path(directory), exist_ok = True)
+
+    with ThreadPoolExecutor(max_workers = config.HMM_WORKERS, thread_name_prefix = 'hmm') as pool:
+        futures = {}
+
+        def submit(gene):
+            if gene not in futures:
+                futures[gene] = pool.submit(score_gene, gene, upstreamBuf, downstreamBuf)
+
+        ''' Genes without a FASTA file or output are scored as their Ensembl batch arrives, the rest afterwards. '''
+
+        if not genome.available():
+            pending = [gene for gene in genes if not os.path.exists(batch_path('fasta', gene+'_'+upstreamBuf+'_'+downstreamBuf+'.fa'))
+                       and not os.path.exists(batch_path('results', pahmm.result_name(gene+'_'+upstreamBuf+'_'+downstreamBuf+'.fa')))]
+            ensembl.fetch_many(pending, upstreamBuf, downstreamBuf, batch_path('fasta'), on_fetched = submit)
+
+        for gene in genes:
+            submit(gene)
+        results = [futures[gene].result() for gene in genes]
+    pahmm.stop_all()
+
+    frames = [read_output(gene, path) for gene, path in zip(genes, results) if path is not None]
+    if frames:
+        count = columnar.write_store(batch_path('store'), pd.concat(frames, ignore_index = True), STORE_COLUMNS)
+        print(count, 'genes written to', batch_path('store'))
+
+    return [gene for gene, path in zip(genes, results) if path is None]
+
+
+if __name__ == '__main__':
+
+    args = sys.argv[1:]
+    if len(args) % 2 == 1:
+        with open(args.pop(0), 'r') as f:
+            names = [line.strip() for line in f if line.strip()]
+        resolved = symbols.table.resolve_many(names)
+        unknown = [name for name in names if resolved[name] == symbols.NOT_FOUND]
+        if unknown:
+            print('not in results.tsv:', ' '.join(unknown), file = sys.stderr)
+        genes = sorted(set(resolved.values()) - {symbols.NOT_FOUND})
+    else:
+        symbols.table.refresh()
+        genes = sorted(symbols.table.sys_names)
+
+    failed = run_batch(genes, *args)
+    print(len(genes) - len(failed), 'of', len(genes), 'genes scored')
@@ -0,0 +1,219 @@
+'''
+Benchmarks for each stage of a query, on generated fixtures.
+
+    python benchmark.py            run and compare with benchmark_baseline.json
+    python benchmark.py save       run and store the results as the new baseline
+
+The fixtures are written to a temporary directory and config is pointed at
+it, so nothing under /var/kristoph_flask is read or written: results.tsv
+with BENCH_GENES genes, a genome FASTA and gene table, the four cumPa/paProb
+dataset pairs with BENCH_ROWS rows per gene, and paHMM .pos.txt outputs of
+each size in BENCH_SIZES.
+
+Every stage reports its best wall time over BENCH_REPEAT runs and its peak
+traced memory (tracemalloc). A stage is flagged as a regression when either
+is more than BENCH_TOLERANCE above the baseline, and the exit status is then
+1. The scale can be changed through the environment variables of the same
+names.
+'''
+
+import json, os, shutil, sys, tempfile, time, tracemalloc
+
+import numpy as np
+
+import config
+
+
+GENES = int(os.environ.get('BENCH_GENES', 6600))
+ROWS = int(os.environ.get('BENCH_ROWS', 40))
+SIZES = [int(size) for size in os.environ.get('BENCH_SIZES', '500,5000,20000,100000').split(',')]
+REPEAT = int(os.environ.get('BENCH_REPEAT', 3))
+TOLERANCE = float(os.environ.get('BENCH_TOLERANCE', 0.25))
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+CHROMOSOMES = ['I', 'II', 'III', 'IV', 'V', 'VI', 'VII', 'VIII', 'IX', 'X', 'XI', 'XII', 'XIII', 'XIV', 'XV', 'XVI']
+CHROMOSOME_LENGTH = 60 * 12666
+
+
+def gene_names(count):
+
+    ''' Systematic names like YAL001C / YBR002W, and a standard name for every other gene. '''
+
+    names = []
+    for i in range(count):
+        chrom = 'ABCDEFGHIJKLMNOP'[i % 16]
+        names.append(('Y'+chrom+'LR'[i % 2]+'%03d' % (i // 16 + 1)+'WC'[(i // 16) % 2], 'GEN'+str(i) if i % 2 == 0 else None))
+
+    return names
+
+
+def write_fixtures(directory):
+
+    rng = np.random.RandomState(0)
+    names = gene_names(GENES)
+
+    with open(os.path.join(directory, 'results.tsv'), 'w') as f:
+        for sys_name, std_name in names:
+            f.write(sys_name+('\t'+std_name if std_name else '')+'\n')
+
+    ''' Genome: random bases, 60 per line, and gene coordinates spread along each chromosome. '''
+
+    with open(config.GENOME_FASTA, 'wb') as f:
+        for chrom in CHROMOSOMES:
+            bases = np.frombuffer(b'ACGT', dtype = 'S1')[rng.randint(0, 4, CHROMOSOME_LENGTH)]
+            f.write(b'>'+chrom.encode()+b'\n')
+            f.write(b'\n'.join(bytes(line) for line in bases.reshape(-1, 60))+b'\n')
+
+    genes = []
+    with open(config.GENE_TABLE, 'w') as f:
+        for i, (sys_name, std_name) in enumerate(names):
+            chrom = CHROMOSOMES[i % 16]
+            start = 1000 + (i // 16) * 1800
+            end = start + 1200
+            strand = 1 if sys_name.endswith('W') else -1
+            genes.append((sys_name, chrom, start, end, strand))
+            f.write('\t'.join([sys_name, chrom, str(start), str(end), str(strand)])+'\n')
+
+    ''' Dataset pairs: ROWS sites per gene, cumulative 'all' in cumPa and per-site 'all' in paProb. '''
+
+    for dataset in config.DATASETS:
+        columns = config.DATASET_COLUMNS[dataset]
+        counts = '\t'.join(['1'] * (len(columns) - 7))
+        for kind in config.DATASET_KINDS:
+            lines = ['\t'.join(columns)]
+            for sys_name, chrom, start, end, strand in genes:
+                p = rng.uniform(0, 1, ROWS)
+                values = np.cumsum(p)/p.sum() if kind == 'cumPa' else p/p.sum()
+                for j in range(ROWS):
+                    position = end + 10*j if strand == 1 else start - 10*j
+                    lines.append('%s\t%s\t%d\t%s\t%d\t%d\t%s\t%.6f' % (sys_name, chrom, position, '+' if strand == 1 else '-',
+                                                                     -10*j, 1200 + 10*j, counts, values[j]))
+            with open(os.path.join(directory, config.dataset_file(dataset, kind)), 'w') as f:
+                f.write('\n'.join(lines)+'\n')
+
+    ''' paHMM outputs: a header line, then Base, Position and the five state scores. '''
+
+    outputs = {}
+    for size in SIZES:
+        scores = rng.uniform(0, 30, (size, 5))
+        bases = np.frombuffer(b'ACGT', dtype = 'S1')[rng.randint(0, 4, size)].astype(str)
+        lines = ['%s %d %.3f %.3f %.3f %.3f %.3f' % ((bases[i], i + 1) + tuple(scores[i])) for i in range(size)]
+        outputs[size] = ('paHMM output\n'+'\n'.join(lines)+'\n').encode()
+
+    return names, outputs
+
+
+def measure(function, *args):
+
+    '''
+    Returns (best seconds over REPEAT runs, peak traced bytes, result). The
+    peak comes from one extra run under tracemalloc, which would otherwise
+    slow the timed runs down.
+    '''
+
+    best = None
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    tracemalloc.start()
+    function(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return best, peak, result
+
+
+def run(directory):
+
+    config.DATA_DIR = directory
+    config.GENOME_FASTA = os.path.join(directory, 'genome.fa')
+    config.GENE_TABLE = os.path.join(directory, 'genes.tsv')
+    config.RESULT_CACHE_DIR = os.path.join(directory, 'cache')
+    config.BUNDLE_DIR = os.path.join(directory, 'bundles')
+    config.SECRET_KEY_FILE = os.path.join(directory, 'secret_key')
+
+    print('writing fixtures to', directory)
+    names, outputs = write_fixtures(directory)
+
+    import application, columnar, gene_index, symbols
+    symbols.table.path = os.path.join(directory, 'results.tsv')
+
+    results = {}
+
+    def record(stage, function, *args):
+        seconds, peak, result = measure(function, *args)
+        results[stage] = {'seconds': seconds, 'peak_bytes': peak}
+        print('%-28s %10.4f s %10.1f MB' % (stage, seconds, peak / 1e6))
+        return result
+
+    queries = [std_name or sys_name.lower() for sys_name, std_name in names[:1000]]
+    gene = names[len(names) // 2][0]
+
+    record('convert_to_symbol x1000', lambda: [application.convert_to_symbol(name) for name in queries])
+    record('get_seq x100', lambda: [application.get_seq(sys_name, '100', '500') for sys_name, std_name in names[:100]])
+
+    load_all = lambda: [application.load_gene_dataset(dataset, kind, gene) for dataset in config.DATASETS for kind in config.DATASET_KINDS]
+    record('datasets (scan)', load_all)
+    gene_index.build_index()
+    record('datasets (index)', load_all)
+    for dataset in config.DATASETS:
+        for kind in config.DATASET_KINDS:
+            columnar.ingest(dataset, kind)
+    record('datasets (columnar)', load_all)
+
+    frames = application.load_gene_frames(gene)
+
+    for size in SIZES:
+        raw_data = record('read_result %d' % size, application.read_result, outputs[size])
+        kmers = record('kmer_windows %d' % size, application.kmer_windows, raw_data.Base.values, 6)
+        cols = record('gridded_plots %d' % size, application.gridded_plots, raw_data, application.TOOLS, frames, '100', kmers, '0'*64)
+        heatmap = record('Intensity_Plot %d' % size, application.Intensity_Plot, raw_data, application.TOOLS)
+        tabs = application.plot_tabs(*(cols + (heatmap,)))
+        script, div = record('components %d' % size, application.components, tabs)
+        results['components %d' % size]['script_bytes'] = len(script)
+
+    return results
+
+
+def compare(results, baseline):
+
+    ''' Returns the stages whose time or peak memory exceeds the baseline by more than TOLERANCE. '''
+
+    regressions = []
+    for stage, result in sorted(results.items()):
+        if stage not in baseline:
+            continue
+        for metric in ['seconds', 'peak_bytes']:
+            before, after = baseline[stage][metric], result[metric]
+            if before > 0 and after > before * (1 + TOLERANCE):
+                regressions.append((stage, metric, before, after))
+
+    return regressions
+
+
+if __name__ == '__main__':
+
+    directory = tempfile.mkdtemp(prefix = 'kristoph_bench')
+    try:
+        results = run(directory)
+    finally:
+        shutil.rmtree(directory, ignore_errors = True)
+
+    if sys.argv[1:] == ['save']:
+        with open(BASELINE, 'w') as f:
+            json.dump(results, f, indent = 1, sort_keys = True)
+        print('baseline saved to', BASELINE)
+    elif os.path.exists(BASELINE):
+        with open(BASELINE, 'r') as f:
+            regressions = compare(results, json.load(f))
+        for stage, metric, before, after in regressions:
+            print('REGRESSION %s %s: %.4g -> %.4g (%+.0f%%)' % (stage, metric, before, after, 100 * (after / before - 1)))
+        if regressions:
+            sys.exit(1)
+        print('no regressions against', BASELINE)
+    else:
+        print('no baseline yet; run "python benchmark.py save" to store one')
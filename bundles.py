@@ -0,0 +1,96 @@
+'''
+Pre-rendered plot bundles for every annotated gene.
+
+Gene queries are deterministic, so the plots for every systematic name in
+results.tsv can be rendered once, offline, and served from disk:
+
+    python bundles.py [upstream downstream]
+
+renders each gene at the given buffers (100 and 500 by default) through the
+normal query pipeline, so watch.py must be running as it is for the web app.
+Genes that already have a bundle are skipped, so an interrupted run can be
+restarted.
+
+A bundle is the gzip-compressed components() JSON plus the paHMM output the
+zoom callbacks read, stored under the same keys as the result cache. Unlike
+the cache they are never evicted, and run_query checks them first.
+'''
+
+import gzip, json, os, sys, tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+
+
+def path(key):
+    return os.path.join(config.BUNDLE_DIR, key[:2], key+'.gz')
+
+
+def load(key):
+
+    ''' Returns the decompressed bundle for key, or None if there is none. '''
+
+    try:
+        with gzip.open(path(key), 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def load_json(key):
+    value = load(key)
+    return None if value is None else json.loads(value.decode())
+
+
+def store(key, value):
+
+    bundle_path = path(key)
+    os.makedirs(os.path.dirname(bundle_path), exist_ok = True)
+
+    fd, tmp_path = tempfile.mkstemp(dir = os.path.dirname(bundle_path), prefix = '.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(gzip.compress(value))
+    os.replace(tmp_path, bundle_path)
+
+    return
+
+
+def prerender(genes, upstreamBuf = '100', downstreamBuf = '500', workers = None):
+
+    '''
+    Renders and stores a bundle for each gene that does not have one yet.
+    Returns the list of genes that failed.
+    '''
+
+    import application
+
+    def render(gene):
+        plot_key, result_key = application.cache_keys(['gene', gene, upstreamBuf, downstreamBuf])
+        if os.path.exists(path(plot_key)):
+            return True
+        try:
+            application.run_query(gene, upstreamBuf, downstreamBuf, '', '')
+        except Exception as e:
+            print(gene, 'failed:', e)
+            return False
+        plots = application.result_cache.get(plot_key)
+        result = application.result_cache.get(result_key)
+        if plots is None or result is None:
+            print(gene, 'failed: evicted from the result cache before it was bundled')
+            return False
+        store(result_key, result)
+        store(plot_key, plots)
+        return True
+
+    with ThreadPoolExecutor(max_workers = workers or config.JOB_WORKERS) as pool:
+        done = list(pool.map(render, genes))
+
+    return [gene for gene, ok in zip(genes, done) if not ok]
+
+
+if __name__ == '__main__':
+    import symbols
+    symbols.table.refresh()
+    genes = sorted(symbols.table.sys_names)
+    failed = prerender(genes, *sys.argv[1:3])
+    print(len(genes) - len(failed), 'of', len(genes), 'genes bundled in', config.BUNDLE_DIR)
@@ -0,0 +1,153 @@
+'''
+Content-addressed on-disk cache with LRU and size-based eviction.
+
+Each entry is one file named by the SHA-256 of its key. A hit bumps the file's
+mtime, which serves as the LRU clock, so every worker process can share one
+cache directory without coordination. Writes go through a temporary file and
+an atomic rename, so readers never see a partial entry.
+
+Each process keeps a running estimate of the cache's size and entry count
+from its own writes, and only scans the directory when the estimate goes
+over a limit or every SWEEP_EVERY writes, which picks up what other
+processes wrote. A scan then evicts down to LOW_WATER of the limits, so a
+full cache is not rescanned on every write.
+'''
+
+import hashlib, json, os, tempfile, threading
+
+
+SWEEP_EVERY = 256
+LOW_WATER = 0.9
+
+
+def make_key(*parts):
+    return hashlib.sha256(json.dumps(parts).encode()).hexdigest()
+
+
+class DiskCache(object):
+
+    def __init__(self, directory, max_bytes, max_entries = None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.total = None
+        self.count = None
+        self.writes = 0
+        self.lock = threading.Lock()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+
+        ''' Returns the cached bytes for key, or None on a miss. '''
+
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+
+        return value
+
+    def touch(self, key):
+
+        ''' Marks key as recently used without reading it; returns False on a miss. '''
+
+        try:
+            os.utime(self.path(key))
+        except FileNotFoundError:
+            return False
+
+        return True
+
+    def set(self, key, value):
+
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+
+        fd, tmp_path = tempfile.mkstemp(dir = os.path.dirname(path), prefix = '.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(value)
+        try:
+            replaced = os.stat(path).st_size
+        except FileNotFoundError:
+            replaced = None
+        os.replace(tmp_path, path)
+
+        with self.lock:
+            self.writes = self.writes + 1
+            if self.total is not None:
+                self.total = self.total + len(value) - (replaced or 0)
+                self.count = self.count + (1 if replaced is None else 0)
+            due = self.total is None or self.writes >= SWEEP_EVERY or self.over_limit(self.total, self.count)
+
+        if due:
+            self.evict()
+
+        return
+
+    def over_limit(self, total, count, fraction = 1.0):
+        return total > self.max_bytes * fraction or (self.max_entries is not None and count > self.max_entries * fraction)
+
+    def get_json(self, key):
+        value = self.get(key)
+        return None if value is None else json.loads(value.decode())
+
+    def set_json(self, key, value):
+        self.set(key, json.dumps(value).encode())
+
+    def entries(self):
+
+        ''' Returns [(mtime, size, path)] for every entry, oldest first. '''
+
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+        for shard in os.listdir(self.directory):
+            shard_dir = os.path.join(self.directory, shard)
+            if not os.path.isdir(shard_dir):
+                continue
+            for name in os.listdir(shard_dir):
+                if name.startswith('.tmp'):
+                    continue
+                path = os.path.join(shard_dir, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+
+        return entries
+
+    def evict(self):
+
+        '''
+        Scans the cache and, if it is over its limits, removes least recently
+        used entries until it is within LOW_WATER of them.
+        '''
+
+        entries = self.entries()
+        total = sum(size for mtime, size, path in entries)
+        count = len(entries)
+        fraction = LOW_WATER if self.over_limit(total, count) else 1.0
+
+        for mtime, size, path in entries:
+            if not self.over_limit(total, count, fraction):
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total = total - size
+            count = count - 1
+
+        with self.lock:
+            self.total = total
+            self.count = count
+            self.writes = 0
+
+        return
@@ -0,0 +1,207 @@
+'''
+Columnar, gene-partitioned binary store for the four experimental datasets.
+
+Ingest converts every *_cumPa.txt / *_paProb.txt pair into a directory of
+NumPy .npy files, one per kept column (config.KEEP_COLUMNS), with the rows
+sorted by gene:
+
+    python columnar.py
+
+    DATA_DIR/columnar/<dataset>/<kind>/genes.npy      sorted unique gene names
+    DATA_DIR/columnar/<dataset>/<kind>/offsets.npy    row range of each gene
+    DATA_DIR/columnar/<dataset>/<kind>/<column>.npy   column values
+
+Columns are memory-mapped at request time, so loading a gene reads only that
+gene's slice of the few columns the plots use instead of parsing the text.
+
+Each store is built in a new hidden directory next to <kind> and published
+by atomically replacing the <kind> symlink, so a reader never sees a half
+written store. The previous version is kept until the next ingest for
+readers still using it. The manifest records the size and mtime of the text
+file, and a store whose text file has changed since is not used.
+'''
+
+import json, os, shutil, sys, tempfile
+import numpy as np
+import pandas as pd
+
+import config
+
+
+STORE_DIR = 'columnar'
+MANIFEST = 'manifest.json'
+
+_column_files = {'#gene': 'gene.npy'}
+
+
+def store_path(dataset, kind):
+    return os.path.join(config.DATA_DIR, STORE_DIR, dataset, kind)
+
+
+def column_file(column):
+    return _column_files.get(column, column+'.npy')
+
+
+def ingest(dataset, kind):
+
+    text_path = os.path.join(config.DATA_DIR, config.dataset_file(dataset, kind))
+    out_dir = store_path(dataset, kind)
+
+    ''' Stat before reading, so a file replaced during the read leaves the store stale rather than wrong. '''
+
+    stat = os.stat(text_path)
+
+    ''' The header line starts with '#gene', so comment = '#' skips it. '''
+
+    frame = pd.read_csv(text_path, sep = '\s+', header = None, comment = '#',
+                        names = config.DATASET_COLUMNS[dataset], usecols = config.KEEP_COLUMNS)
+
+    count = write_store(out_dir, frame, config.KEEP_COLUMNS, source = {'size': stat.st_size, 'mtime': stat.st_mtime})
+
+    print(dataset, kind, len(frame), 'rows', count, 'genes')
+
+    return
+
+
+def write_store(out_dir, frame, columns, source = None):
+
+    '''
+    Writes frame[columns] to out_dir in the store layout, rows sorted by the
+    '#gene' column, and returns the number of genes. Replaces any existing
+    store in out_dir. `source`, the size and mtime of the file the rows came
+    from, is kept in the manifest for has_store.
+    '''
+
+    ''' A stable sort keeps each gene's rows in file order. '''
+
+    frame = frame.sort_values('#gene', kind = 'mergesort').reset_index(drop = True)
+    genes, starts = np.unique(frame['#gene'].values.astype(str), return_index = True)
+    offsets = np.append(starts, len(frame))
+
+    parent, name = os.path.split(out_dir)
+    os.makedirs(parent, exist_ok = True)
+    build_dir = tempfile.mkdtemp(dir = parent, prefix = '.'+name+'.')
+    os.chmod(build_dir, 0o755)
+
+    np.save(os.path.join(build_dir, 'genes.npy'), genes)
+    np.save(os.path.join(build_dir, 'offsets.npy'), offsets)
+    for column in columns:
+        if column == '#gene':
+            continue
+        values = frame[column].values
+        if values.dtype == object:
+            values = values.astype(str)
+        np.save(os.path.join(build_dir, column_file(column)), values)
+
+    ''' The manifest goes last: a version without one is unfinished. '''
+
+    with open(os.path.join(build_dir, MANIFEST), 'w') as f:
+        json.dump({'rows': len(frame), 'genes': len(genes), 'columns': columns, 'source': source}, f)
+
+    publish(out_dir, build_dir)
+
+    return len(genes)
+
+
+def publish(out_dir, build_dir):
+
+    '''
+    Points the out_dir symlink at build_dir, and removes the finished
+    versions older than the one it replaces.
+    '''
+
+    parent, name = os.path.split(out_dir)
+
+    if os.path.islink(out_dir):
+        previous = os.path.realpath(out_dir)
+    elif os.path.isdir(out_dir):
+
+        ''' A store written before stores were versioned; move it aside as the previous version. '''
+
+        previous = tempfile.mkdtemp(dir = parent, prefix = '.'+name+'.')
+        os.rmdir(previous)
+        os.rename(out_dir, previous)
+    else:
+        previous = None
+
+    link_path = build_dir+'.link'
+    os.symlink(os.path.basename(build_dir), link_path)
+    os.replace(link_path, out_dir)
+
+    for entry in os.listdir(parent):
+        path = os.path.join(parent, entry)
+        if not entry.startswith('.'+name+'.') or path in (build_dir, previous) or os.path.islink(path):
+            continue
+        if os.path.exists(os.path.join(path, MANIFEST)):
+            shutil.rmtree(path, ignore_errors = True)
+
+    return
+
+
+def has_store(dataset, kind):
+
+    ''' True if the dataset has been ingested and its text file has not changed since. '''
+
+    try:
+        with open(os.path.join(store_path(dataset, kind), MANIFEST), 'r') as f:
+            source = json.load(f).get('source')
+    except FileNotFoundError:
+        return False
+
+    if source is None:
+        return True
+
+    try:
+        stat = os.stat(os.path.join(config.DATA_DIR, config.dataset_file(dataset, kind)))
+    except FileNotFoundError:
+        return True
+
+    return stat.st_size == source['size'] and stat.st_mtime == source['mtime']
+
+
+def load_gene(dataset, kind, gene, columns = None):
+
+    '''
+    Returns the rows of `gene` as a DataFrame holding `columns` (default
+    config.KEEP_COLUMNS), in the same order as the text file.
+    '''
+
+    if columns is None:
+        columns = config.KEEP_COLUMNS
+
+    return read_gene(store_path(dataset, kind), gene, columns)
+
+
+def read_gene(directory, gene, columns):
+
+    ''' Returns the rows of `gene` from the store in `directory`. '''
+
+    ''' Resolve the symlink once, so every file comes from the same version. '''
+
+    directory = os.path.realpath(directory)
+    genes = np.load(os.path.join(directory, 'genes.npy'))
+    i = np.searchsorted(genes, gene)
+
+    if i < len(genes) and genes[i] == gene:
+        offsets = np.load(os.path.join(directory, 'offsets.npy'), mmap_mode = 'r')
+        start, stop = int(offsets[i]), int(offsets[i+1])
+    else:
+        start, stop = 0, 0
+
+    frame = pd.DataFrame()
+    for column in columns:
+        if column == '#gene':
+            frame[column] = np.full(stop - start, gene, dtype = object)
+        else:
+            values = np.load(os.path.join(directory, column_file(column)), mmap_mode = 'r')
+            frame[column] = np.array(values[start:stop])
+
+    return frame
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        config.DATA_DIR = sys.argv[1]
+    for dataset in config.DATASETS:
+        for kind in config.DATASET_KINDS:
+            ingest(dataset, kind)
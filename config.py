@@ -0,0 +1,137 @@
+'''
+Shared paths for the Flask application and its helper scripts.
+'''
+
+import os
+
+DATA_DIR = '/var/kristoph_flask/data'
+
+'''
+The four experimental datasets, each with a cumulative (cumPa) and a
+per-site probability (paProb) file in DATA_DIR.
+'''
+
+DATASETS = ['pcf11', 'decay', 'decay2', 'steinmetz']
+DATASET_KINDS = ['cumPa', 'paProb']
+
+
+def dataset_file(dataset, kind):
+    return dataset+'_'+kind+'.txt'
+
+'''
+Column layout of the dataset files. Every file starts with the same ten
+annotation columns, followed by per-library read counts and the pooled 'all'
+column. Only KEEP_COLUMNS are used by the plots.
+'''
+
+ANNOTATION_COLUMNS = ['#gene', 'chromo', 'position', 'strand', 'distToCDSstop', 'distToCDSstart', 'avgGcount', 'AGcount', 'Acount', 'Gcount']
+
+DATASET_COLUMNS = {
+    'pcf11': ANNOTATION_COLUMNS + ['DHch0'+str(n)+'_20nt_Ttrim' for n in range(1, 9)] + ['all'],
+    'decay': ANNOTATION_COLUMNS + [s+t+'e1_filtered_uniq30nt' for s in ['UA', 'UB', 'YA', 'YB'] for t in ['00', '05', '10', '20', '40']] + ['all'],
+    'decay2': ANNOTATION_COLUMNS + [s+t+'e2_filtered_uniq30nt' for s in ['UA', 'UB', 'YA', 'YB'] for t in ['00', '05', '10', '20', '40']] + ['all'],
+    'steinmetz': ANNOTATION_COLUMNS + ['Lane8ByIB_30nt_Ttrim', 'Lane8ByIIB_30nt_Ttrim', 'Lane8ByIIIB_30nt_Ttrim', 'Lane8TS1248IB_30nt_Ttrim', 'Lane8TS1248IIIB_30nt_Ttrim',
+                                       'Lane8TS685IB_30nt_Ttrim', 'Lane8TS685IIB_30nt_Ttrim', 'Lane8TS801IB_30nt_Ttrim', 'Lane8TS801IIB_30nt_Ttrim', 'Lane8TS801IIIB_30nt_Ttrim',
+                                       'lane3BY4741III_30nt_Ttrim', 'lane3TS1248II_30nt_Ttrim', 'lane3TS685III_30nt_Ttrim', 'lane3TS685II_30nt_Ttrim', 'lane3TS801III_30nt_Ttrim', 'lane3TS801I_30nt_Ttrim', 'all'],
+}
+
+KEEP_COLUMNS = ['#gene', 'chromo', 'position', 'distToCDSstop', 'distToCDSstart', 'all']
+
+'''
+paHMM locations. The web app writes FASTA files and batch scripts to
+OUTFILES_DIR, watch.py runs paHMM on them, paHMM writes its output to
+EXPORT_DIR, and watch.py moves each finished output into RESULT_DIR.
+'''
+
+OUTFILES_DIR = '/var/kristoph_flask/outfiles'
+HMM_DIR = '/var/www/vhosts/knaggert-vm.mdibl.net/flask_project/paHMM/testHMM'
+HMM_BIN = '/var/www/vhosts/knaggert-vm.mdibl.net/flask_project/paHMM/bin/hmm'
+EXPORT_DIR = HMM_DIR+'/Export'
+RESULT_DIR = EXPORT_DIR+'/complete'
+
+HMM_TIMEOUT = 600
+
+''' Number of hmm processes watch.py runs at once. '''
+
+HMM_WORKERS = os.cpu_count() or 1
+
+'''
+Keep one hmm process per worker alive with the model loaded, instead of
+starting hmm for every batch script.
+'''
+
+HMM_PERSISTENT = True
+
+''' Number of queries /jobs runs at once. '''
+
+JOB_WORKERS = 4
+
+''' paHMM output and rendered plots, shared by all workers. '''
+
+RESULT_CACHE_DIR = '/var/kristoph_flask/cache/results'
+RESULT_CACHE_BYTES = 2 * 1024**3
+RESULT_CACHE_ENTRIES = 20000
+
+'''
+Local genome for get_seq (see genome.py). When both files exist, gene
+sequences are sliced from the FASTA instead of fetched from Ensembl.
+'''
+
+GENOME_FASTA = DATA_DIR+'/Saccharomyces_cerevisiae.R64-1-1.dna.toplevel.fa'
+GENE_TABLE = DATA_DIR+'/gene_coordinates.tsv'
+
+''' Points per series sent to the browser for the per-position line plots. '''
+
+PLOT_POINTS = 2000
+
+''' Pre-rendered plots for every annotated gene (see bundles.py). '''
+
+BUNDLE_DIR = '/var/kristoph_flask/cache/bundles'
+
+''' Working and output directory of batch.py. '''
+
+BATCH_DIR = '/var/kristoph_flask/batch'
+
+''' Session signing key shared by all worker processes, unless FLASK_SECRET_KEY is set. '''
+
+SECRET_KEY_FILE = '/var/kristoph_flask/secret_key'
+
+'''
+Show a preview of uncached queries that fills in as paHMM writes its output
+(see streaming.py), instead of waiting for the full run. Off by default:
+each open stream holds a server thread for the whole paHMM run, and jobs
+only exist in the process that queued them, so it needs a single-process
+deployment.
+'''
+
+STREAM_RESULTS = False
+STREAM_INTERVAL = 0.25
+STREAM_ROWS = 5000
+
+'''
+Request profiling (see profiler.py): a POST to /?profile=<PROFILE_TOKEN>
+runs the query under the sampling profiler and links the speedscope file.
+Off unless the PROFILE_TOKEN environment variable is set.
+'''
+
+PROFILE_TOKEN = os.environ.get('PROFILE_TOKEN')
+PROFILE_DIR = '/var/kristoph_flask/profiles'
+PROFILE_INTERVAL = 0.005
+
+'''
+Ensembl REST client used when the local genome is not installed (see
+ensembl.py): retries with backoff, a (connect, read) timeout in seconds, and
+a cache of fetched sequences.
+'''
+
+ENSEMBL_SERVER = 'https://rest.ensembl.org'
+ENSEMBL_RETRIES = 3
+ENSEMBL_TIMEOUT = (3.05, 15)
+SEQUENCE_CACHE_DIR = '/var/kristoph_flask/cache/sequences'
+SEQUENCE_CACHE_BYTES = 256 * 1024**2
+
+''' Bulk fetches (ensembl.fetch_many): ids per POST, requests in flight, requests per second. '''
+
+ENSEMBL_BATCH_SIZE = 50
+ENSEMBL_CONCURRENCY = 4
+ENSEMBL_RATE = 15
@@ -0,0 +1,88 @@
+'''
+Level-of-detail downsampling for the per-position line plots.
+
+The first render ships at most config.PLOT_POINTS points per series, picked
+by min-max decimation so peaks and troughs survive. When the user zooms or
+pans, window_loader() fetches the visible window from /plotdata at the same
+budget, which is full resolution once the window is small enough.
+'''
+
+import numpy as np
+from bokeh.models import CustomJS
+
+
+def minmax(y, n_out):
+
+    '''
+    Returns the sorted indices of at most n_out points of y: the minimum and
+    maximum of each of (n_out - 2)/2 equal buckets, plus both end points.
+    '''
+
+    n = len(y)
+    if n <= n_out or n_out < 4:
+        return np.arange(n)
+
+    size = -(-n // ((n_out - 2) // 2))
+    buckets = -(-n // size)
+
+    ''' Pad the last bucket with the final value; padded indices map back to n - 1. '''
+
+    padded = np.empty(buckets * size)
+    padded[:n] = y
+    padded[n:] = y[-1]
+    padded = padded.reshape(buckets, size)
+
+    base = np.arange(buckets) * size
+    keep = np.concatenate([[0, n - 1], base + np.argmin(padded, axis = 1), base + np.argmax(padded, axis = 1)])
+    keep = np.minimum(keep, n - 1)
+
+    return np.unique(keep)
+
+
+def decimate(frame, x, columns, n_out):
+
+    '''
+    Returns at most n_out rows of frame (ordered by `x`): the union of what
+    minmax keeps for each of `columns` at an equal share of the budget, so
+    every series in a shared source keeps its own shape.
+    '''
+
+    if len(frame) <= n_out:
+        return frame
+
+    share = max(n_out // len(columns), 4)
+    keep = np.unique(np.concatenate([minmax(frame[column].values.astype(float), share) for column in columns]))
+
+    return frame.iloc[keep]
+
+
+def window_loader(source, url):
+
+    '''
+    CustomJS for an x_range: after the range settles, replace source.data
+    with the window fetched from url&start=..&end=...
+    '''
+
+    return CustomJS(args = dict(source = source), code = '''
+        var range = cb_obj;
+        var start = Math.min(range.start, range.end);
+        var end = Math.max(range.start, range.end);
+        var states = window.lodStates = window.lodStates || {};
+        var state = states[source.id] = states[source.id] || {};
+        if (state.start === start && state.end === end) {
+            return;
+        }
+        clearTimeout(state.timer);
+        state.timer = setTimeout(function() {
+            state.start = start;
+            state.end = end;
+            var request = new XMLHttpRequest();
+            request.open('GET', '%s&start=' + start + '&end=' + end);
+            request.onload = function() {
+                if (request.status == 200) {
+                    source.data = JSON.parse(request.responseText);
+                }
+            };
+            request.send();
+        }, 250);
+    ''' % url)
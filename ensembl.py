@@ -0,0 +1,210 @@
+'''
+Client for the Ensembl REST sequence endpoint.
+
+Requests go through keep-alive requests.Sessions, with ENSEMBL_RETRIES
+retries and exponential backoff on connection errors and 429/5xx responses,
+but not on read timeouts, and a hard (connect, read) timeout of
+ENSEMBL_TIMEOUT. Only the bulk session used by fetch_many honours
+Retry-After; the single-gene GETs made while a web request waits rely on the
+bounded backoff, so a large Retry-After cannot hold a request thread. Sequences are kept in an on-disk cache (see cache.py)
+keyed by the gene and both buffers, so a repeated query never leaves the
+machine.
+
+Failures raise EnsemblError instead of ending the process, so a worker
+reports the query as failed and carries on.
+
+fetch_many() is the bulk version for batch.py: it sends the genes in POST
+/sequence/id requests of ENSEMBL_BATCH_SIZE ids, at most
+ENSEMBL_CONCURRENCY at a time and ENSEMBL_RATE per second, and writes each
+FASTA file as its batch comes back.
+
+    python ensembl.py genes.txt out_dir [upstream downstream]
+'''
+
+import asyncio, os, sys, tempfile, threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+import cache, config
+
+
+class EnsemblError(Exception):
+    pass
+
+
+sequence_cache = cache.DiskCache(config.SEQUENCE_CACHE_DIR, config.SEQUENCE_CACHE_BYTES)
+
+_sessions = {}
+_session_lock = threading.Lock()
+
+
+def session(bulk = False):
+
+    ''' The shared interactive or bulk Session, created on first use. '''
+
+    with _session_lock:
+        if bulk not in _sessions:
+
+            '''
+            A read timeout is not retried, so a stalled upstream costs one
+            timeout, not several. POST /sequence/id only reads, so it is
+            retried like a GET.
+            '''
+
+            retries = Retry(total = config.ENSEMBL_RETRIES, read = 0, backoff_factor = 0.5, status_forcelist = [429, 500, 502, 503, 504],
+                            allowed_methods = ['GET', 'POST'], respect_retry_after_header = bulk)
+            adapter = HTTPAdapter(pool_connections = 1, pool_maxsize = config.JOB_WORKERS + config.HMM_WORKERS, max_retries = retries)
+            _sessions[bulk] = requests.Session()
+            _sessions[bulk].mount('https://', adapter)
+            _sessions[bulk].mount('http://', adapter)
+
+    return _sessions[bulk]
+
+
+def sequence_key(gene_from_genome, upstreamBuf, downstreamBuf):
+    return cache.make_key('sequence', gene_from_genome, str(upstreamBuf), str(downstreamBuf))
+
+
+def get_seq(gene_from_genome, upstreamBuf, downstreamBuf):
+
+    '''
+    Returns the FASTA text of a gene with upstreamBuf and downstreamBuf bases
+    added on either side. Raises EnsemblError if Ensembl cannot be reached
+    in time or does not return a sequence.
+    '''
+
+    key = sequence_key(gene_from_genome, upstreamBuf, downstreamBuf)
+    seq = sequence_cache.get(key)
+    if seq is not None:
+        return seq.decode()
+
+    url = config.ENSEMBL_SERVER+'/sequence/id/'+gene_from_genome
+    params = {'expand_5prime': upstreamBuf, 'expand_3prime': downstreamBuf}
+
+    try:
+        r = session().get(url, params = params, headers = {'Content-Type': 'text/x-fasta'}, timeout = config.ENSEMBL_TIMEOUT)
+    except requests.RequestException as e:
+        raise EnsemblError('Ensembl request for '+gene_from_genome+' failed: '+str(e))
+
+    if not r.ok:
+        raise EnsemblError('Ensembl returned '+str(r.status_code)+' for '+gene_from_genome)
+
+    seq = r.text
+    if not seq.startswith('>'):
+        raise EnsemblError('Ensembl returned no sequence for '+gene_from_genome)
+
+    sequence_cache.set(key, seq.encode())
+
+    return seq
+
+
+def fasta(entry):
+
+    ''' FASTA text for one entry of a POST /sequence/id response, with 60 bases per line like the GET endpoint. '''
+
+    seq = entry['seq']
+    header = '>'+entry['id']+(' '+entry['desc'] if entry.get('desc') else '')
+
+    return header+'\n'+'\n'.join(seq[i:i+60] for i in range(0, len(seq), 60))+'\n'
+
+
+def post_sequences(genes, upstreamBuf, downstreamBuf):
+
+    ''' Fetches up to ENSEMBL_BATCH_SIZE genes in one request; returns {gene: FASTA text}. '''
+
+    body = {'ids': genes, 'expand_5prime': int(upstreamBuf), 'expand_3prime': int(downstreamBuf)}
+    headers = {'Content-Type': 'application/json', 'Accept': 'application/json'}
+
+    try:
+        r = session(bulk = True).post(config.ENSEMBL_SERVER+'/sequence/id', json = body, headers = headers, timeout = config.ENSEMBL_TIMEOUT)
+    except requests.RequestException as e:
+        raise EnsemblError('Ensembl request for '+str(len(genes))+' genes failed: '+str(e))
+
+    if not r.ok:
+        raise EnsemblError('Ensembl returned '+str(r.status_code)+' for '+str(len(genes))+' genes')
+
+    return {entry.get('query', entry['id']): fasta(entry) for entry in r.json() if entry.get('seq')}
+
+
+class RateLimiter(object):
+
+    ''' Spaces the start of requests at least 1/rate seconds apart. '''
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.next = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self.lock:
+            now = asyncio.get_event_loop().time()
+            delay = self.next - now
+            self.next = max(now, self.next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+async def _fetch_many(genes, upstreamBuf, downstreamBuf, out_dir, on_fetched):
+
+    loop = asyncio.get_event_loop()
+    limiter = RateLimiter(config.ENSEMBL_RATE)
+    slots = asyncio.Semaphore(config.ENSEMBL_CONCURRENCY)
+    written = []
+
+    def write(gene, seq):
+        sequence_cache.set(sequence_key(gene, upstreamBuf, downstreamBuf), seq.encode())
+        fd, tmp_path = tempfile.mkstemp(dir = out_dir, prefix = '.tmp')
+        with os.fdopen(fd, 'w') as f:
+            f.write(seq)
+        os.replace(tmp_path, os.path.join(out_dir, gene+'_'+upstreamBuf+'_'+downstreamBuf+'.fa'))
+
+    async def fetch(batch):
+        async with slots:
+            await limiter.wait()
+            try:
+                sequences = await loop.run_in_executor(executor, post_sequences, batch, upstreamBuf, downstreamBuf)
+            except EnsemblError as e:
+                print(e, file = sys.stderr)
+                return
+        for gene, seq in sequences.items():
+            await loop.run_in_executor(executor, write, gene, seq)
+            written.append(gene)
+            if on_fetched is not None:
+                on_fetched(gene)
+
+    size = config.ENSEMBL_BATCH_SIZE
+    with ThreadPoolExecutor(max_workers = config.ENSEMBL_CONCURRENCY, thread_name_prefix = 'ensembl') as executor:
+        await asyncio.gather(*[fetch(genes[i:i+size]) for i in range(0, len(genes), size)])
+
+    return written
+
+
+def fetch_many(genes, upstreamBuf, downstreamBuf, out_dir, on_fetched = None):
+
+    '''
+    Writes out_dir/<gene>_<upstream>_<downstream>.fa for each gene, the file
+    name batch.py uses, adds it to the sequence cache and calls
+    on_fetched(gene) if given. Returns the genes Ensembl returned no sequence
+    for.
+    '''
+
+    os.makedirs(out_dir, exist_ok = True)
+
+    loop = asyncio.new_event_loop()
+    try:
+        written = loop.run_until_complete(_fetch_many(list(genes), str(upstreamBuf), str(downstreamBuf), out_dir, on_fetched))
+    finally:
+        loop.close()
+
+    return sorted(set(genes) - set(written))
+
+
+if __name__ == '__main__':
+
+    with open(sys.argv[1], 'r') as f:
+        names = [line.strip() for line in f if line.strip()]
+    missing = fetch_many(names, *(sys.argv[3:5] or ['100', '500']), out_dir = sys.argv[2])
+    print(len(names) - len(missing), 'of', len(names), 'sequences written to', sys.argv[2])
@@ -0,0 +1,126 @@
+'''
+Per-gene byte-offset index for the pcf11/decay/decay2/steinmetz datasets.
+
+The dataset files are grouped by systematic gene name (the '#gene' column), so
+each gene's rows can be found with a single seek instead of scanning the whole
+file. Build the index once, and again whenever a dataset file is replaced:
+
+    python gene_index.py
+
+The index records the size and mtime of every dataset it covers. A dataset
+that has changed since the index was built is treated as unindexed, and the
+caller falls back to scanning it.
+'''
+
+import os, pickle, sys
+
+import config
+
+
+INDEX_FILE = 'gene_index.pkl'
+
+_loaded = {'mtime': None, 'index': None}
+
+
+def index_path():
+    return os.path.join(config.DATA_DIR, INDEX_FILE)
+
+
+def index_dataset(file_path):
+
+    '''
+    Returns {gene: [(start, end), ...]} byte ranges for one dataset file.
+    Consecutive rows of the same gene are merged into a single range.
+    '''
+
+    ranges = {}
+    offset = 0
+
+    with open(file_path, 'rb') as f:
+        for line in f:
+            end = offset + len(line)
+            fields = line.split(None, 1)
+            if fields and not fields[0].startswith(b'#'):
+                spans = ranges.setdefault(fields[0].decode(), [])
+                if spans and spans[-1][1] == offset:
+                    spans[-1] = (spans[-1][0], end)
+                else:
+                    spans.append((offset, end))
+            offset = end
+
+    return ranges
+
+
+def build_index():
+
+    index = {}
+
+    for dataset in config.DATASETS:
+        for kind in config.DATASET_KINDS:
+            name = config.dataset_file(dataset, kind)
+            file_path = os.path.join(config.DATA_DIR, name)
+            stat = os.stat(file_path)
+            index[name] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'genes': index_dataset(file_path)}
+            print(name, len(index[name]['genes']), 'genes')
+
+    ''' Write to a temporary file first so readers never load a partial index. '''
+
+    tmp_path = index_path()+'.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(index, f, protocol = pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, index_path())
+
+    return index
+
+
+def load_index():
+
+    '''
+    Returns the index, reloading it only when the index file has changed.
+    Returns None if no index has been built.
+    '''
+
+    try:
+        mtime = os.stat(index_path()).st_mtime
+    except FileNotFoundError:
+        return None
+
+    if _loaded['mtime'] != mtime:
+        with open(index_path(), 'rb') as f:
+            _loaded['index'] = pickle.load(f)
+        _loaded['mtime'] = mtime
+
+    return _loaded['index']
+
+
+def read_gene_rows(name, gene):
+
+    '''
+    Returns the raw lines of dataset file `name` whose '#gene' column is
+    `gene`, as bytes (b'' if the gene has no rows). Returns None if the file
+    is not indexed or has changed since indexing, so the caller can scan it.
+    '''
+
+    index = load_index()
+    if index is None or name not in index:
+        return None
+
+    entry = index[name]
+    file_path = os.path.join(config.DATA_DIR, name)
+    stat = os.stat(file_path)
+    if stat.st_size != entry['size'] or stat.st_mtime != entry['mtime']:
+        return None
+
+    chunks = []
+    with open(file_path, 'rb') as f:
+        for start, end in entry['genes'].get(gene, []):
+            f.seek(start)
+            chunks.append(f.read(end - start))
+
+    return b''.join(chunks)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        config.DATA_DIR = sys.argv[1]
+    build_index()
@@ -0,0 +1,233 @@
+'''
+Local S. cerevisiae R64 genome for get_seq, so gene queries do not need the
+Ensembl REST API.
+
+Needs two files in DATA_DIR (see config.py):
+
+    GENOME_FASTA  the R64 genome FASTA, with a samtools-style .fai index next
+                  to it (built on first use if missing). A bgzip-compressed
+                  FASTA (.gz, with .fai and .gzi) is read through pysam.
+    GENE_TABLE    systematic name, chromosome, start, end, strand (1 or -1),
+                  tab separated, 1-based inclusive coordinates. Build it from
+                  an Ensembl or SGD GFF3 file with:
+
+                      python genome.py Saccharomyces_cerevisiae.R64-1-1.gff3
+
+Sequence is sliced straight from a memory-mapped FASTA, and genes on the
+minus strand are reverse complemented, matching Ensembl's
+/sequence/id/<gene>?expand_5prime=..;expand_3prime=.. output.
+'''
+
+import mmap, os, sys, threading
+
+import config
+
+try:
+    import pysam
+except ImportError:
+    pysam = None
+
+
+ASSEMBLY = 'R64-1-1'
+
+''' SGD GFF chromosome names, once 'chr' is stripped, that differ from the Ensembl FASTA. '''
+
+CHROMOSOME_NAMES = {'mt': 'Mito'}
+
+_COMPLEMENT = bytes.maketrans(b'ACGTNacgtn', b'TGCANtgcan')
+
+_lock = threading.Lock()
+_loaded = {}
+
+
+class GenomeError(Exception):
+    pass
+
+
+def available():
+    return os.path.exists(config.GENOME_FASTA) and os.path.exists(config.GENE_TABLE)
+
+
+def build_fai(fasta_path):
+
+    ''' Writes a samtools faidx index (name, length, offset, line bases, line width). '''
+
+    records = []
+    with open(fasta_path, 'rb') as f:
+        name = None
+        offset = 0
+        for line in f:
+            if line.startswith(b'>'):
+                if name is not None:
+                    records.append((name, length, seq_offset, line_bases, line_width))
+                name = line[1:].split()[0].decode()
+                length = 0
+                seq_offset = offset + len(line)
+                line_bases = line_width = None
+            elif name is not None:
+                bases = len(line.rstrip(b'\r\n'))
+                if line_bases is None:
+                    line_bases, line_width = bases, len(line)
+                length = length + bases
+            offset = offset + len(line)
+        if name is not None:
+            records.append((name, length, seq_offset, line_bases, line_width))
+
+    with open(fasta_path+'.fai', 'w') as f:
+        for record in records:
+            f.write('\t'.join(str(field) for field in record)+'\n')
+
+    return
+
+
+class IndexedFasta(object):
+
+    ''' Random access to an uncompressed FASTA through its .fai index and mmap. '''
+
+    def __init__(self, fasta_path):
+        if not os.path.exists(fasta_path+'.fai'):
+            build_fai(fasta_path)
+        self.index = {}
+        with open(fasta_path+'.fai', 'r') as f:
+            for line in f:
+                name, length, offset, line_bases, line_width = line.split('\t')[:5]
+                self.index[name] = (int(length), int(offset), int(line_bases), int(line_width))
+        self.file = open(fasta_path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access = mmap.ACCESS_READ)
+
+    def length(self, chrom):
+        return self.index[chrom][0]
+
+    def fetch(self, chrom, start, end):
+
+        ''' Returns bases start..end (0-based, end exclusive) of chrom as bytes. '''
+
+        length, offset, line_bases, line_width = self.index[chrom]
+        end = min(end, length)
+        if start >= end:
+            return b''
+        first = offset + (start // line_bases) * line_width + start % line_bases
+        last = offset + ((end - 1) // line_bases) * line_width + (end - 1) % line_bases
+        return self.map[first:last+1].replace(b'\n', b'').replace(b'\r', b'')
+
+
+class BgzipFasta(object):
+
+    ''' The same interface for a bgzip-compressed FASTA, through pysam. '''
+
+    def __init__(self, fasta_path):
+        if pysam is None:
+            raise GenomeError('reading a bgzip-compressed genome needs pysam')
+        self.fasta = pysam.FastaFile(fasta_path)
+
+    def length(self, chrom):
+        return self.fasta.get_reference_length(chrom)
+
+    def fetch(self, chrom, start, end):
+        return self.fasta.fetch(chrom, start, end).encode()
+
+
+def load_gene_table(path):
+
+    genes = {}
+    with open(path, 'r') as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) < 5 or fields[0].startswith('#'):
+                continue
+            genes[fields[0]] = (fields[1], int(fields[2]), int(fields[3]), int(fields[4]))
+
+    return genes
+
+
+def _genome():
+
+    ''' Opens the FASTA and gene table once per process. '''
+
+    if 'fasta' not in _loaded:
+        with _lock:
+            if 'fasta' not in _loaded:
+                _loaded['genes'] = load_gene_table(config.GENE_TABLE)
+                if config.GENOME_FASTA.endswith('.gz'):
+                    _loaded['fasta'] = BgzipFasta(config.GENOME_FASTA)
+                else:
+                    _loaded['fasta'] = IndexedFasta(config.GENOME_FASTA)
+
+    return _loaded['fasta'], _loaded['genes']
+
+
+def reverse_complement(seq):
+    return seq.translate(_COMPLEMENT)[::-1]
+
+
+def get_seq(gene_from_genome, upstreamBuf, downstreamBuf):
+
+    '''
+    Returns the gene plus upstreamBuf bases on its 5' side and downstreamBuf
+    bases on its 3' side, on the gene's strand, as a FASTA record. Raises
+    GenomeError if the gene or its chromosome is not in the local genome.
+    '''
+
+    fasta, genes = _genome()
+
+    if gene_from_genome not in genes:
+        raise GenomeError('no coordinates for '+gene_from_genome)
+
+    chrom, start, end, strand = genes[gene_from_genome]
+    upstreamBuf, downstreamBuf = int(upstreamBuf), int(downstreamBuf)
+
+    try:
+        length = fasta.length(chrom)
+    except KeyError:
+        raise GenomeError('chromosome '+chrom+' of '+gene_from_genome+' is not in '+config.GENOME_FASTA)
+
+    if strand == 1:
+        start, end = start - upstreamBuf, end + downstreamBuf
+    else:
+        start, end = start - downstreamBuf, end + upstreamBuf
+    start, end = max(start, 1), min(end, length)
+
+    seq = fasta.fetch(chrom, start - 1, end).upper()
+    if strand != 1:
+        seq = reverse_complement(seq)
+    seq = seq.decode()
+
+    header = '>'+gene_from_genome+' chromosome:'+ASSEMBLY+':'+chrom+':'+str(start)+':'+str(end)+':'+str(strand)
+    lines = [seq[i:i+60] for i in range(0, len(seq), 60)]
+
+    return header+'\n'+'\n'.join(lines)+'\n'
+
+
+def build_gene_table(gff_path, out_path):
+
+    ''' Writes GENE_TABLE from the 'gene' features of a GFF3 file. '''
+
+    count = 0
+    with open(gff_path, 'r') as gff, open(out_path, 'w') as out:
+        for line in gff:
+            if line.startswith('#'):
+                continue
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) < 9 or fields[2] != 'gene':
+                continue
+            attributes = dict(item.split('=', 1) for item in fields[8].split(';') if '=' in item)
+            name = attributes.get('ID', '')
+            if name.startswith('gene:'):
+                name = name[len('gene:'):]
+            if not name:
+                continue
+            strand = '1' if fields[6] == '+' else '-1'
+            chrom = fields[0]
+            if chrom.startswith('chr'):
+                chrom = chrom[len('chr'):]
+            chrom = CHROMOSOME_NAMES.get(chrom, chrom)
+            out.write('\t'.join([name, chrom, fields[3], fields[4], strand])+'\n')
+            count = count + 1
+
+    print(count, 'genes written to', out_path)
+
+    return
+
+
+if __name__ == '__main__':
+    build_gene_table(sys.argv[1], sys.argv[2] if len(sys.argv) > 2 else config.GENE_TABLE)
@@ -0,0 +1,90 @@
+'''
+Minimal Linux inotify binding (ctypes, no third-party packages).
+
+    with inotify.Watch('/some/dir', inotify.IN_MOVED_TO) as watch:
+        for mask, name, directory in watch.read(timeout = 5):
+            ...
+
+available() is False on platforms without inotify; callers fall back to
+polling the directory.
+'''
+
+import ctypes, ctypes.util, os, select, struct
+
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+
+_EVENT = struct.Struct('iIII')
+
+
+def _load_libc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno = True)
+        libc.inotify_init1, libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+_libc = _load_libc()
+
+
+def available():
+    return _libc is not None
+
+
+class Watch(object):
+
+    '''
+    Watches one or more directories for the events in `mask`. read() returns
+    a list of (mask, file name, directory) triples, or [] if nothing happened
+    within `timeout`.
+    '''
+
+    def __init__(self, directory, mask):
+        if _libc is None:
+            raise OSError('inotify is not available on this platform')
+        self.fd = _libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.directories = {}
+        try:
+            self.add(directory, mask)
+        except OSError:
+            self.close()
+            raise
+
+    def add(self, directory, mask):
+        wd = _libc.inotify_add_watch(self.fd, os.fsencode(directory), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_add_watch failed', directory)
+        self.directories[wd] = directory
+
+    def fileno(self):
+        return self.fd
+
+    def read(self, timeout = None):
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        data = os.read(self.fd, 65536)
+        events = []
+        i = 0
+        while i < len(data):
+            wd, mask, cookie, length = _EVENT.unpack_from(data, i)
+            name = data[i+_EVENT.size:i+_EVENT.size+length].rstrip(b'\0')
+            events.append((mask, os.fsdecode(name), self.directories.get(wd)))
+            i = i + _EVENT.size + length
+        return events
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
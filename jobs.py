@@ -0,0 +1,111 @@
+'''
+In-process job queue for paHMM queries.
+
+POST /jobs submits a query and returns a job id straight away; a fixed pool of
+worker threads drains the queue and runs the pipeline, so a slow paHMM run
+holds a worker thread instead of an HTTP connection. GET /jobs/<id> reports
+the job's status and, once it is done, its plot components.
+
+While a job runs, `output` is the path of the paHMM output file being
+written, if it needs a paHMM run at all; GET /jobs/<id>/stream tails it
+(see streaming.py).
+
+Jobs are held in the memory of the process that queued them, so a job id is
+only valid there; with several worker processes, requests for a job must
+reach the same one.
+'''
+
+import threading, time, uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+_current = threading.local()
+
+
+def current():
+
+    ''' Returns the job the calling worker thread is running, or None. '''
+
+    return getattr(_current, 'job', None)
+
+
+class Job(object):
+
+    def __init__(self, args):
+        self.id = uuid.uuid4().hex
+        self.args = args
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.output = None
+
+    def as_dict(self):
+        job = {'job_id': self.id, 'status': self.status, 'submitted': self.submitted,
+               'started': self.started, 'finished': self.finished}
+        if self.status == DONE:
+            job['script'], job['div'] = self.result
+        elif self.status == FAILED:
+            job['error'] = self.error
+        return job
+
+
+class JobQueue(object):
+
+    '''
+    Runs `run(*args)` for every submitted job on `workers` threads. Only the
+    most recent `max_jobs` jobs are kept; older finished jobs are forgotten.
+    '''
+
+    def __init__(self, run, workers = 4, max_jobs = 1000):
+        self.run = run
+        self.max_jobs = max_jobs
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers = workers, thread_name_prefix = 'pahmm-job')
+
+    def submit(self, *args):
+        job = Job(args)
+        with self.lock:
+            self.jobs[job.id] = job
+            self._prune()
+        self.executor.submit(self._execute, job)
+        return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def depth(self):
+        with self.lock:
+            return sum(1 for job in self.jobs.values() if job.status == QUEUED)
+
+    def _execute(self, job):
+        job.status = RUNNING
+        job.started = time.time()
+        _current.job = job
+        try:
+            job.result = self.run(*job.args)
+            job.status = DONE
+        except Exception as e:
+            job.error = str(e) or e.__class__.__name__
+            job.status = FAILED
+        finally:
+            _current.job = None
+        job.finished = time.time()
+
+    def _prune(self):
+        for job_id in list(self.jobs):
+            if len(self.jobs) <= self.max_jobs:
+                break
+            if self.jobs[job_id].status in (DONE, FAILED):
+                del self.jobs[job_id]
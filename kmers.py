@@ -0,0 +1,27 @@
+'''
+Sliding k-mer windows over a paHMM result's Base column.
+'''
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+
+def kmer_windows(bases, k = 6):
+
+    '''
+    Returns an object array with, at each position i, the k bases starting
+    at i. The last k positions get "N/A", as in the original plots.
+
+    The windows are built in one pass over a strided byte view of the
+    sequence instead of indexing the Series base by base.
+    '''
+
+    n = len(bases)
+    windows = np.full(n, 'N/A', dtype = object)
+
+    if n > k:
+        codes = np.frombuffer(''.join(bases).encode('ascii'), dtype = 'S1')
+        strided = as_strided(codes, shape = (n - k, k), strides = (codes.strides[0], codes.strides[0]))
+        windows[:n-k] = np.ascontiguousarray(strided).view('S'+str(k)).ravel().astype('U'+str(k))
+
+    return windows
@@ -0,0 +1,137 @@
+'''
+Request pipeline metrics in the Prometheus text format, served on /metrics.
+
+    kristoph_stage_seconds{stage=...}               histogram of each query stage
+    kristoph_cache_lookups_total{cache=..,outcome=..}  hits and misses per cache
+    kristoph_job_queue_depth                        jobs waiting for a worker
+
+Metrics are kept per process; with several worker processes, scrape each one
+or sum them in Prometheus.
+'''
+
+import threading, time
+from contextlib import contextmanager
+
+
+''' Seconds; a paHMM run can take minutes, a cached lookup microseconds. '''
+
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _labels(names, values, extra = ()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{'+','.join(name+'="'+str(value).replace('\\', '\\\\').replace('"', '\\"')+'"' for name, value in pairs)+'}'
+
+
+class Metric(object):
+
+    kind = None
+
+    def __init__(self, name, description, labels = ()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def key(self, labels):
+        return tuple(labels[name] for name in self.labels)
+
+    def render(self):
+        lines = ['# HELP '+self.name+' '+self.description, '# TYPE '+self.name+' '+self.kind]
+        with self.lock:
+            for key in sorted(self.values):
+                lines.extend(self.samples(key, self.values[key]))
+        return lines
+
+    def samples(self, key, value):
+        return [self.name+_labels(self.labels, key)+' '+repr(float(value))]
+
+
+class Counter(Metric):
+
+    kind = 'counter'
+
+    def inc(self, amount = 1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+
+class Histogram(Metric):
+
+    kind = 'histogram'
+
+    def __init__(self, name, description, labels = (), buckets = STAGE_BUCKETS):
+        super(Histogram, self).__init__(name, description, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            if key not in self.values:
+                self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            counts, total, count = self.values[key]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] = counts[i] + 1
+            self.values[key][1] = total + value
+            self.values[key][2] = count + 1
+
+    @contextmanager
+    def time(self, **labels):
+
+        ''' Observes the time spent in the with block, including when it raises. '''
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self, key, value):
+        counts, total, count = value
+        lines = []
+        for bound, bucket in zip(self.buckets, counts):
+            lines.append(self.name+'_bucket'+_labels(self.labels, key, [('le', repr(float(bound)))])+' '+str(bucket))
+        lines.append(self.name+'_bucket'+_labels(self.labels, key, [('le', '+Inf')])+' '+str(count))
+        lines.append(self.name+'_sum'+_labels(self.labels, key)+' '+repr(total))
+        lines.append(self.name+'_count'+_labels(self.labels, key)+' '+str(count))
+        return lines
+
+
+REGISTRY = []
+
+
+def render():
+    return '\n'.join(line for metric in REGISTRY for line in metric.render())+'\n'
+
+
+STAGE_SECONDS = Histogram('kristoph_stage_seconds', 'Time spent in each stage of a query.', labels = ['stage'])
+CACHE_LOOKUPS = Counter('kristoph_cache_lookups_total', 'Bundle, plot and paHMM output cache lookups.', labels = ['cache', 'outcome'])
+QUEUE_DEPTH = Gauge('kristoph_job_queue_depth', 'Jobs waiting for a worker thread.')
+
+
+def stage(name):
+    return STAGE_SECONDS.time(stage = name)
+
+
+def cache_lookup(cache, value):
+
+    ''' Counts a lookup in `cache` as a hit or miss, and returns value. '''
+
+    CACHE_LOOKUPS.inc(cache = cache, outcome = 'miss' if value is None else 'hit')
+
+    return value
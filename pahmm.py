@@ -0,0 +1,236 @@
+'''
+Hand-off of paHMM results between watch.py and the web application.
+
+paHMM writes <fasta name>.pos.txt into EXPORT_DIR while it runs. Once the hmm
+process has exited, watch.py publishes the output by renaming it into
+RESULT_DIR. The rename is atomic, so a file that exists in RESULT_DIR is always
+complete, and the web application wakes on the inotify event for that rename
+instead of polling.
+
+PersistentHMM keeps one hmm process per worker alive with the yeastHMM model
+loaded, so each query only pays for its own 'apply'. run() executes one batch
+script that way for both watch.py and batch.py.
+'''
+
+import os, subprocess, sys, threading, time
+
+import config, inotify
+
+
+HMM_MODEL = 'yeastHMM'
+HMM_PARAMETERS = 'yeastP'
+HMM_STATES = '3 22 41 55 64 -1'
+
+''' Columns of a .pos.txt output, after its header line. '''
+
+RESULT_COLUMNS = ['Base', 'Position', 'e1', 'e2', 'e3', 'pASite', 'e4']
+
+
+class HMMError(Exception):
+    pass
+
+
+class HMMTimeout(HMMError):
+    pass
+
+
+def batch_script(fasta_path):
+
+    ''' The hmm command sequence for one FASTA file, as written by create_batchScript. '''
+
+    return '\n'.join([config.HMM_DIR, 'load', HMM_MODEL, 'apply', HMM_PARAMETERS, HMM_STATES, fasta_path, 'exit'])
+
+
+def fasta_path_from_script(script_path):
+    with open(script_path, 'r') as f:
+        return f.read().split('\n')[6]
+
+
+def result_name(fasta_name):
+    return fasta_name+'.pos.txt'
+
+
+def fasta_name_from_script(script_name):
+
+    ''' testScript_<name>.txt -> <name>.fa (see create_batchScript) '''
+
+    return script_name[len('testScript_'):-len('.txt')]+'.fa'
+
+
+def publish_result(fasta_name):
+
+    '''
+    Moves a finished paHMM output from EXPORT_DIR into RESULT_DIR. Returns the
+    published path, or None if paHMM produced no output.
+    '''
+
+    name = result_name(fasta_name)
+    source = os.path.join(config.EXPORT_DIR, name)
+    if not os.path.exists(source):
+        return None
+
+    os.makedirs(config.RESULT_DIR, exist_ok = True)
+    target = os.path.join(config.RESULT_DIR, name)
+    os.replace(source, target)
+
+    return target
+
+
+def wait_for_result(name, timeout = None):
+
+    '''
+    Blocks until RESULT_DIR/name has been published and returns its path.
+    Raises TimeoutError if it does not appear within `timeout` seconds.
+    '''
+
+    if timeout is None:
+        timeout = config.HMM_TIMEOUT
+
+    path = os.path.join(config.RESULT_DIR, name)
+    deadline = time.time() + timeout
+
+    if not inotify.available():
+        while not os.path.exists(path):
+            if time.time() > deadline:
+                raise TimeoutError('paHMM result '+name+' not published after '+str(timeout)+' s')
+            time.sleep(0.1)
+        return path
+
+    os.makedirs(config.RESULT_DIR, exist_ok = True)
+
+    with inotify.Watch(config.RESULT_DIR, inotify.IN_MOVED_TO | inotify.IN_CLOSE_WRITE) as watch:
+
+        ''' Check only after the watch is in place, so a rename in between is not missed. '''
+
+        while not os.path.exists(path):
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise TimeoutError('paHMM result '+name+' not published after '+str(timeout)+' s')
+            for mask, event_name, directory in watch.read(remaining):
+                if event_name == name:
+                    break
+
+    return path
+
+
+class PersistentHMM(object):
+
+    '''
+    A long-lived hmm process that loads the model once and then applies it to
+    one FASTA file per apply() call, reading commands from a pipe exactly as
+    it would from a batch script.
+
+    hmm reports nothing on stdin/stdout when an 'apply' finishes, so apply()
+    treats the output file being closed after writing (IN_CLOSE_WRITE) as
+    completion. hmm takes a single FASTA path per 'apply', so inputs are not
+    batched further.
+    '''
+
+    def __init__(self):
+        self.process = None
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def start(self):
+        self.process = subprocess.Popen([config.HMM_BIN], stdin = subprocess.PIPE, universal_newlines = True)
+        self._send([config.HMM_DIR, 'load', HMM_MODEL])
+
+    def stop(self):
+        if self.alive():
+            try:
+                self._send(['exit'])
+                self.process.wait(5)
+            except (HMMError, subprocess.TimeoutExpired):
+                self.process.kill()
+                self.process.wait()
+        self.process = None
+
+    def _send(self, lines):
+        try:
+            self.process.stdin.write('\n'.join(lines)+'\n')
+            self.process.stdin.flush()
+        except (BrokenPipeError, ValueError):
+            raise HMMError('hmm exited unexpectedly')
+
+    def apply(self, fasta_path, timeout = None):
+
+        '''
+        Runs the model on fasta_path and returns the path of its output in
+        EXPORT_DIR once hmm has finished writing it.
+        '''
+
+        if timeout is None:
+            timeout = config.HMM_TIMEOUT
+        if not self.alive():
+            self.start()
+
+        name = result_name(os.path.basename(fasta_path))
+        deadline = time.time() + timeout
+
+        with inotify.Watch(config.EXPORT_DIR, inotify.IN_CLOSE_WRITE) as watch:
+            self._send(['apply', HMM_PARAMETERS, HMM_STATES, fasta_path])
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self.process.kill()
+                    self.process.wait()
+                    self.process = None
+                    raise HMMTimeout('hmm did not finish '+fasta_path+' within '+str(timeout)+' s')
+                for mask, event_name, directory in watch.read(min(remaining, 1)):
+                    if event_name == name:
+                        return os.path.join(config.EXPORT_DIR, name)
+                if not self.alive():
+                    raise HMMError('hmm exited while processing '+fasta_path)
+
+
+_workers = threading.local()
+_started = []
+
+
+def run_script(script_path):
+
+    ''' Runs a batch script with a fresh hmm; raises HMMTimeout if it takes longer than HMM_TIMEOUT. '''
+
+    with open(script_path, 'r') as script:
+        try:
+            subprocess.run([config.HMM_BIN], stdin = script, timeout = config.HMM_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            raise HMMTimeout('hmm did not finish '+script_path+' within '+str(config.HMM_TIMEOUT)+' s')
+
+
+def run(script_path):
+
+    '''
+    Runs one batch script, leaving its output in EXPORT_DIR. With
+    HMM_PERSISTENT the FASTA file is handed to the calling thread's
+    long-lived hmm process; if that process dies, the script is run with a
+    fresh hmm instead. An input that timed out is not run again. Raises
+    HMMTimeout after HMM_TIMEOUT seconds.
+    '''
+
+    if config.HMM_PERSISTENT and inotify.available():
+        if not hasattr(_workers, 'hmm'):
+            _workers.hmm = PersistentHMM()
+            _started.append(_workers.hmm)
+        try:
+            _workers.hmm.apply(fasta_path_from_script(script_path))
+        except HMMTimeout:
+            raise
+        except HMMError as e:
+            print(e, '- rerunning', os.path.basename(script_path), 'with a fresh hmm', file = sys.stderr)
+            run_script(script_path)
+    else:
+        run_script(script_path)
+
+    return
+
+
+def stop_all():
+
+    ''' Stops every persistent hmm process run() has started. '''
+
+    while _started:
+        _started.pop().stop()
+
+    return
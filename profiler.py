@@ -0,0 +1,131 @@
+'''
+Sampling profiler for single requests, with speedscope output.
+
+    with profiler.Sampler() as sampler:
+        ...
+    profile_id = profiler.save(sampler.speedscope('YLR115W 100 500'))
+
+A background thread records the Python stack of the profiled thread every
+config.PROFILE_INTERVAL seconds. The result is a speedscope "sampled"
+profile (https://www.speedscope.app/file-format-schema.json), which
+speedscope.app shows as a flamegraph; profiles are kept in PROFILE_DIR.
+
+Sampling only reads the stack, so the profiled code runs at close to its
+normal speed, unlike under cProfile.
+'''
+
+import hmac, json, os, re, sys, tempfile, threading, time, uuid
+
+import config
+
+
+class Sampler(object):
+
+    def __init__(self, thread_id = None, interval = None):
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = interval if interval is not None else config.PROFILE_INTERVAL
+        self.frames = []
+        self.frame_ids = {}
+        self.samples = []
+        self.weights = []
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def __enter__(self):
+        self.start = self.last = time.perf_counter()
+        self.thread = threading.Thread(target = self.run, name = 'profiler', daemon = True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+        self.end = time.perf_counter()
+        return False
+
+    def frame_id(self, frame):
+        code = frame.f_code
+        key = (code.co_name, code.co_filename, code.co_firstlineno)
+        if key not in self.frame_ids:
+            self.frame_ids[key] = len(self.frames)
+            self.frames.append({'name': code.co_name, 'file': code.co_filename, 'line': code.co_firstlineno})
+        return self.frame_ids[key]
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            now = time.perf_counter()
+            if frame is None:
+                continue
+
+            ''' Outermost call first, as speedscope expects. '''
+
+            stack = []
+            while frame is not None:
+                stack.append(self.frame_id(frame))
+                frame = frame.f_back
+            stack.reverse()
+
+            self.samples.append(stack)
+            self.weights.append(now - self.last)
+            self.last = now
+
+    def speedscope(self, name):
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': name,
+            'exporter': 'kristoph_flask profiler',
+            'shared': {'frames': self.frames},
+            'profiles': [{
+                'type': 'sampled',
+                'name': name,
+                'unit': 'seconds',
+                'startValue': 0,
+                'endValue': self.end - self.start,
+                'samples': self.samples,
+                'weights': self.weights,
+            }],
+        }
+
+
+def allowed(token):
+
+    ''' True if token matches config.PROFILE_TOKEN; profiling is off when no token is configured. '''
+
+    if not config.PROFILE_TOKEN or not token:
+        return False
+
+    return hmac.compare_digest(str(token), str(config.PROFILE_TOKEN))
+
+
+def path(profile_id):
+    return os.path.join(config.PROFILE_DIR, profile_id+'.speedscope.json')
+
+
+def save(profile):
+
+    ''' Stores a profile and returns its id. '''
+
+    profile_id = uuid.uuid4().hex
+    os.makedirs(config.PROFILE_DIR, exist_ok = True)
+
+    fd, tmp_path = tempfile.mkstemp(dir = config.PROFILE_DIR, prefix = '.tmp')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(profile, f)
+    os.replace(tmp_path, path(profile_id))
+
+    return profile_id
+
+
+def load(profile_id):
+
+    ''' Returns the stored profile as JSON text, or None for an unknown or malformed id. '''
+
+    if not re.match(r'^[0-9a-f]{32}$', profile_id):
+        return None
+
+    try:
+        with open(path(profile_id), 'r') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
@@ -0,0 +1,48 @@
+'''
+Vectorized pA-site scoring used by gridded_plots.
+
+Each function replaces a per-position Python loop with a single NumPy pass;
+test_scoring.py checks them against the original loops.
+'''
+
+import numpy as np
+
+
+def site_probability(pASite, a = 1.5, b = 18.5):
+
+    ''' Logistic transform of the paHMM pA-site score: 1 - 1/(1 + 2^(a(x - b))). '''
+
+    return 1 - 1/(1 + np.power(2.0, a*(np.asarray(pASite, dtype = float) - b)))
+
+
+def independent_cumulative(p):
+
+    '''
+    Returns (cumulative, p), both divided by the total of p, so the
+    cumulative curve ends at 1.
+    '''
+
+    cumulative = np.cumsum(p)
+    total = cumulative[-1]
+
+    return cumulative/total, np.asarray(p)/total
+
+
+def staged_cumulative(p):
+
+    '''
+    The staged recurrence c[i] = c[i-1] + (1 - c[i-1])*p[i], c[0] = p[0],
+    which is 1 - prod(1 - p[:i+1]), normalised to end at 1.
+    '''
+
+    staged = 1 - np.cumprod(1 - np.asarray(p, dtype = float))
+
+    return staged/staged[-1]
+
+
+def site_increments(cumulative):
+
+    ''' Per-site probabilities from a dataset's cumulative 'all' column. '''
+
+    return np.diff(np.asarray(cumulative, dtype = float), prepend = 0.0)
+
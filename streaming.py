@@ -0,0 +1,105 @@
+'''
+Server-Sent Events for a running query.
+
+paHMM appends rows to EXPORT_DIR/<fasta>.pos.txt as it works along the
+sequence. job_events() tails that file while the job runs and sends every
+batch of complete rows as a 'rows' event, in the column layout of a
+ColumnDataSource, so the page can pass it straight to source.stream(). When
+the job finishes, a 'done' event carries the job's status and plots.
+
+The file is opened as soon as it appears and read through the same handle
+after watch.py renames it into RESULT_DIR, so no rows are lost at the
+hand-off.
+
+Jobs live in the memory of the process that queued them, so streaming
+(config.STREAM_RESULTS) only works when the app runs as a single process.
+'''
+
+import json, os, time
+
+import config, jobs, pahmm
+
+
+STREAM_COLUMNS = ['Position', 'e1', 'e2', 'e3', 'pASite', 'e4']
+
+
+def event(name, data):
+    return 'event: '+name+'\ndata: '+json.dumps(data)+'\n\n'
+
+
+def parse_rows(lines):
+
+    ''' Parses complete .pos.txt lines into {column: [values]}; other lines are skipped. '''
+
+    rows = {column: [] for column in STREAM_COLUMNS}
+    for line in lines:
+        fields = line.split()
+        if len(fields) != len(pahmm.RESULT_COLUMNS):
+            continue
+        try:
+            values = [int(fields[1])] + [float(field) for field in fields[2:]]
+        except ValueError:
+            continue
+        for column, value in zip(STREAM_COLUMNS, values):
+            rows[column].append(value)
+
+    return rows
+
+
+def open_output(path):
+
+    ''' Opens a paHMM output in EXPORT_DIR, or in RESULT_DIR if it has already been published. '''
+
+    for candidate in [path, os.path.join(config.RESULT_DIR, os.path.basename(path))]:
+        try:
+            return open(candidate, 'rb')
+        except FileNotFoundError:
+            pass
+
+    return None
+
+
+def job_events(job, interval = None):
+
+    '''
+    Yields SSE messages for `job` until it has finished: 'rows' events with
+    at most config.STREAM_ROWS rows each, then one 'done' event.
+    '''
+
+    if interval is None:
+        interval = config.STREAM_INTERVAL
+
+    output = None
+    pending = b''
+    header = True
+
+    try:
+        while True:
+            finished = job.status in (jobs.DONE, jobs.FAILED)
+
+            if output is None and job.output is not None:
+                output = open_output(job.output)
+
+            if output is not None:
+                pending = pending + output.read()
+                lines = pending.split(b'\n')
+                pending = lines.pop()
+                if finished and pending:
+                    lines.append(pending)
+                    pending = b''
+                if header and lines:
+                    lines = lines[1:]
+                    header = False
+                for start in range(0, len(lines), config.STREAM_ROWS):
+                    rows = parse_rows(lines[start:start+config.STREAM_ROWS])
+                    if rows['Position']:
+                        yield event('rows', rows)
+
+            if finished:
+                yield event('done', job.as_dict())
+                return
+
+            time.sleep(interval)
+    finally:
+        if output is not None:
+            output.close()
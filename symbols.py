@@ -0,0 +1,83 @@
+'''
+In-memory lookup table for yeast gene names (results.tsv).
+
+results.tsv has one gene per line: the systematic name, optionally followed by
+the standard name. The table is read once into two dictionaries and re-read
+automatically when the file's mtime changes.
+'''
+
+import os, threading
+
+import config
+
+
+NOT_FOUND = 'dne'
+
+
+class SymbolTable(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.mtime = None
+        self.sys_names = {}
+        self.std_names = {}
+        self.lock = threading.Lock()
+
+    def load(self):
+
+        sys_names = {}
+        std_names = {}
+
+        with open(self.path, 'r') as f:
+            for line in f:
+                fields = line.split()
+                if not fields:
+                    continue
+                sys_names[fields[0]] = fields[0]
+                if len(fields) > 1:
+                    std_names.setdefault(fields[1], fields[0])
+
+        self.sys_names, self.std_names = sys_names, std_names
+
+        return
+
+    def refresh(self):
+
+        ''' Reloads the table if results.tsv has changed since it was read. '''
+
+        mtime = os.stat(self.path).st_mtime
+        if mtime != self.mtime:
+            with self.lock:
+                if mtime != self.mtime:
+                    self.load()
+                    self.mtime = mtime
+
+        return
+
+    def resolve(self, name):
+
+        '''
+        Returns the systematic name for a systematic or standard gene name
+        (case-insensitive), or NOT_FOUND.
+        '''
+
+        self.refresh()
+        name = name.upper()
+        return self.sys_names.get(name) or self.std_names.get(name, NOT_FOUND)
+
+    def resolve_many(self, names):
+
+        ''' Resolves a list of names in one call; returns {name: systematic name}. '''
+
+        self.refresh()
+        sys_names, std_names = self.sys_names, self.std_names
+
+        resolved = {}
+        for name in names:
+            upper = name.upper()
+            resolved[name] = sys_names.get(upper) or std_names.get(upper, NOT_FOUND)
+
+        return resolved
+
+
+table = SymbolTable(os.path.join(config.DATA_DIR, 'results.tsv'))
@@ -0,0 +1,118 @@
+'''
+Checks ensembl.fetch_many against a local stub of POST /sequence/id: ids are
+batched, requests are bounded and rate limited, 429s are retried and every
+FASTA file is written.
+
+    python -m pytest test_ensembl.py
+'''
+
+import json, os, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import cache, config, ensembl
+
+
+class StubEnsembl(BaseHTTPRequestHandler):
+
+    ''' Answers each POST after `delay` seconds; ids ending in X are unknown. '''
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        server = self.server
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        with server.lock:
+            server.started.append(time.monotonic())
+            server.batches.append(body['ids'])
+            server.active = server.active + 1
+            server.max_active = max(server.max_active, server.active)
+            limited = server.limit_first > 0
+            server.limit_first = server.limit_first - 1
+        time.sleep(server.delay)
+        if limited:
+            self.send_response(429)
+            self.send_header('Retry-After', '0')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        else:
+            entries = [{'id': gene, 'query': gene, 'seq': 'ACGT' * 20, 'desc': 'chromosome:R64-1-1:I:1:80:1'}
+                       for gene in body['ids'] if not gene.endswith('X')]
+            data = json.dumps(entries).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        with server.lock:
+            server.active = server.active - 1
+
+
+@pytest.fixture
+def stub(tmp_path, monkeypatch):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubEnsembl)
+    server.lock = threading.Lock()
+    server.started, server.batches = [], []
+    server.active = server.max_active = 0
+    server.limit_first = 0
+    server.delay = 0.05
+    thread = threading.Thread(target = server.serve_forever, daemon = True)
+    thread.start()
+
+    monkeypatch.setattr(config, 'ENSEMBL_SERVER', 'http://127.0.0.1:%d' % server.server_port)
+    monkeypatch.setattr(config, 'ENSEMBL_BATCH_SIZE', 10)
+    monkeypatch.setattr(config, 'ENSEMBL_CONCURRENCY', 2)
+    monkeypatch.setattr(config, 'ENSEMBL_RATE', 20)
+    monkeypatch.setattr(ensembl, 'sequence_cache', cache.DiskCache(str(tmp_path / 'sequences'), 10**8))
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
+
+
+def test_fetch_many_batches_and_writes(stub, tmp_path):
+    genes = ['G%03d' % i for i in range(45)] + ['GX']
+    fetched = []
+    out_dir = str(tmp_path / 'fasta')
+
+    missing = ensembl.fetch_many(genes, '100', '500', out_dir, on_fetched = fetched.append)
+
+    assert missing == ['GX']
+    assert sorted(fetched) == genes[:-1]
+    assert len(stub.batches) == 5
+    assert all(len(batch) <= 10 for batch in stub.batches)
+    assert sorted(gene for batch in stub.batches for gene in batch) == sorted(genes)
+    assert sorted(os.listdir(out_dir)) == sorted(gene+'_100_500.fa' for gene in genes[:-1])
+    with open(os.path.join(out_dir, 'G000_100_500.fa')) as f:
+        assert f.read().startswith('>G000 chromosome:R64-1-1:I:1:80:1\nACGT')
+
+    ''' The sequence cache serves the single-gene client afterwards. '''
+
+    assert ensembl.get_seq('G001', '100', '500').startswith('>G001')
+
+
+def test_fetch_many_is_bounded_and_rate_limited(stub, tmp_path):
+    genes = ['G%03d' % i for i in range(80)]
+
+    ensembl.fetch_many(genes, '100', '500', str(tmp_path / 'fasta'))
+
+    started = sorted(stub.started)
+    assert len(started) == 8
+    assert stub.max_active <= config.ENSEMBL_CONCURRENCY
+
+    ''' Eight requests at 20 per second span at least 7/20 s, less some scheduling slack. '''
+
+    assert started[-1] - started[0] >= 7 / config.ENSEMBL_RATE * 0.8
+
+
+def test_fetch_many_retries_rate_limited_batches(stub, tmp_path):
+    stub.limit_first = 1
+    genes = ['G%03d' % i for i in range(10)]
+
+    missing = ensembl.fetch_many(genes, '100', '500', str(tmp_path / 'fasta'))
+
+    assert missing == []
+    assert len(stub.batches) == 2
@@ -0,0 +1,74 @@
+'''
+Checks the vectorized kernels in scoring.py against the per-position loops
+they replaced in gridded_plots.
+
+    python -m pytest test_scoring.py
+'''
+
+import numpy as np
+
+import scoring
+
+
+def reference_probability(pASite):
+    temp = []
+    for q in range(len(pASite)):
+        temp.append(1 - 1/(1 + 2**(1.5*(pASite[q] - 18.5))))
+    return temp
+
+
+def reference_independent(temp):
+    temp2 = []
+    for s in range(len(temp)):
+        if (s == 0):
+            temp2.append(temp[0])
+        else:
+            temp2.append(temp[s]+temp2[s-1])
+    return np.array(temp2)/temp2[-1], np.array(temp)/temp2[-1]
+
+
+def reference_staged(pASiteT):
+    cumul2 = []
+    for y in range(len(pASiteT)):
+        if (y == 0):
+            cumul2.append(pASiteT[0])
+        else:
+            cumul2.append(cumul2[y-1]+(1 - cumul2[y-1])*pASiteT[y])
+    return np.array(cumul2)/cumul2[-1]
+
+
+def reference_increments(all_column):
+    d1 = []
+    for m in range(len(all_column)):
+        if (m == 0):
+            d1.append(all_column[m])
+        else:
+            d1.append(all_column[m]-all_column[m-1])
+    return d1
+
+
+def pASite_scores():
+    return np.random.RandomState(0).uniform(0, 40, 5000)
+
+
+def test_site_probability():
+    pASite = pASite_scores()
+    assert np.allclose(scoring.site_probability(pASite), reference_probability(pASite), rtol = 1e-12, atol = 0)
+
+
+def test_independent_cumulative():
+    pASite = pASite_scores()
+    cumulative, pASiteT = reference_independent(reference_probability(pASite))
+    new_cumulative, new_pASiteT = scoring.independent_cumulative(scoring.site_probability(pASite))
+    assert np.allclose(new_cumulative, cumulative, rtol = 1e-9, atol = 1e-12)
+    assert np.allclose(new_pASiteT, pASiteT, rtol = 1e-9, atol = 1e-15)
+
+
+def test_staged_cumulative():
+    pASiteT = reference_independent(reference_probability(pASite_scores()))[1]
+    assert np.allclose(scoring.staged_cumulative(pASiteT), reference_staged(pASiteT), rtol = 1e-9, atol = 1e-12)
+
+
+def test_site_increments():
+    all_column = np.sort(np.random.RandomState(1).uniform(0, 1, 300))
+    assert np.allclose(scoring.site_increments(all_column), reference_increments(all_column), rtol = 1e-12, atol = 1e-15)
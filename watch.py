@@ -1,38 +1,94 @@
-import os, time, subprocess
-
-path_to_watch = '/var/kristoph_flask/outfiles'
-path_to_watch2 = '/var/kristoph_flask/outfiles/testScripts'
-
-before = dict ([(f, None) for f in os.listdir (path_to_watch)])
-before2 = dict ([(z, None) for z in os.listdir (path_to_watch2)])
-
-while 1:
-    
-    after = dict ([(f, None) for f in os.listdir (path_to_watch)])
-    added = [f for f in after if not f in before]
-    
-    for i in added:
-        if 'testScript_' in i:
-            args1 = 'sudo mv /var/kristoph_flask/outfiles/'+i+' /var/kristoph_flask/outfiles/testScripts/'
-            subprocess.run(args1, shell=True)
-        elif '.fa' in i:
-            args2 = 'sudo mv /var/kristoph_flask/outfiles/'+i+' /var/kristoph_flask/outfiles/fa_files/'
-            subprocess.run(args2, shell=True)
-        else:
-            args3 = 'sudo rm /var/kristoph_flask/outfiles/'+i
-            subprocess.run(args3, shell=True)
-    
-    after2 = dict ([(z, None) for z in os.listdir (path_to_watch2)])
-    added2 = [z for z in after2 if not z in before2]
-    
-    if added2:
-        for j in added2:
-            print(j)
-            time.sleep(5)
-            args = '/var/www/vhosts/knaggert-vm.mdibl.net/flask_project/paHMM/bin/hmm < /var/kristoph_flask/outfiles/testScripts/'+j
-            subprocess.run(args, shell=True)
-    
-    before = after
-    before2 = after2
-    added.clear()
-    added2.clear()
+'''
+watch.py - runs paHMM on the files the web application writes.
+
+The application writes a FASTA file into OUTFILES_DIR and then a batch script
+(testScript_*.txt) into OUTFILES_DIR/testScripts. The watcher wakes on the
+inotify event for each finished file, moves FASTA files into fa_files/, and
+hands every batch script to a pool that runs up to HMM_WORKERS hmm processes
+at once, each keeping a long-lived hmm process when HMM_PERSISTENT is set.
+Each finished output is published with pahmm.publish_result so the waiting
+request wakes up.
+
+Files already present when the watcher starts are left alone.
+'''
+
+import os, sys, time
+from concurrent.futures import ThreadPoolExecutor
+
+import config, inotify, pahmm
+
+
+path_to_watch = config.OUTFILES_DIR
+script_dir = os.path.join(config.OUTFILES_DIR, 'testScripts')
+fasta_dir = os.path.join(config.OUTFILES_DIR, 'fa_files')
+
+
+def run_hmm(script_name):
+
+    ''' Runs one batch script and publishes its output. '''
+
+    try:
+        pahmm.run(os.path.join(script_dir, script_name))
+        pahmm.publish_result(pahmm.fasta_name_from_script(script_name))
+    except Exception as e:
+        print('hmm failed for', script_name, e, file = sys.stderr)
+
+    return
+
+
+def dispatch(name, directory, pool):
+
+    source = os.path.join(directory, name)
+    if not os.path.isfile(source):
+        return
+
+    if directory == script_dir:
+        if 'testScript_' in name:
+            pool.submit(run_hmm, name)
+    elif 'testScript_' in name:
+        os.replace(source, os.path.join(script_dir, name))
+    elif '.fa' in name:
+        os.replace(source, os.path.join(fasta_dir, name))
+    else:
+        os.remove(source)
+
+    return
+
+
+def poll_events():
+
+    ''' Fallback for platforms without inotify: list both directories twice a second. '''
+
+    before = {d: set(os.listdir(d)) for d in (path_to_watch, script_dir)}
+
+    while True:
+        time.sleep(0.5)
+        for directory in (path_to_watch, script_dir):
+            after = set(os.listdir(directory))
+            for name in sorted(after - before[directory]):
+                yield name, directory
+            before[directory] = after
+
+
+def main():
+
+    pool = ThreadPoolExecutor(max_workers = config.HMM_WORKERS, thread_name_prefix = 'hmm')
+
+    if not inotify.available():
+        for name, directory in poll_events():
+            dispatch(name, directory, pool)
+
+    '''
+    Both directories share one inotify queue, so a FASTA file is always moved
+    before the batch script written after it is dispatched.
+    '''
+
+    with inotify.Watch(path_to_watch, inotify.IN_CLOSE_WRITE | inotify.IN_MOVED_TO) as watch:
+        watch.add(script_dir, inotify.IN_CLOSE_WRITE | inotify.IN_MOVED_TO)
+        while True:
+            for mask, name, directory in watch.read():
+                dispatch(name, directory, pool)
+
+
+if __name__ == '__main__':
+    main()